@@ -0,0 +1,100 @@
+import argparse
+import base64
+import io
+import json
+import tempfile
+import time
+from threading import Thread
+import numpy as np
+from PIL import Image
+
+from capture_archive import CaptureArchive
+from classification_worker import ClassificationWorker, FRAME_SHAPE
+
+# -----------------------------------------------------------------------------
+# Benchmark: preview FPS while classifications run in a thread or a process
+# -----------------------------------------------------------------------------
+# No camera or LCD is needed. The preview loop is emulated with the same steps
+# as camera_feed_loop (channel flip, PIL conversion, byte transfer to luma), and
+# the classification load encodes, archives and "parses" a response in Python.
+
+FRAME_INTERVAL = 0.05
+
+def cpu_bound_classify():
+    """Stand-in for the HTTP request and response handling, mostly pure Python."""
+    payload = json.dumps({"image": base64.b64encode(bytes(200_000)).decode("ascii")})
+    json.loads(payload)
+    total = 0
+    for i in range(400_000):
+        total += i % 7
+    return "Recyclable", 2
+
+def preview_frame(raw_frame, worker=None):
+    """One iteration of the emulated preview loop."""
+    frame = np.ascontiguousarray(raw_frame[:, :, 2::-1])
+    if worker:
+        worker.write_frame(frame)
+    image = Image.fromarray(frame)
+    # luma.lcd turns the image into a list of bytes before sending it over SPI.
+    list(image.tobytes())
+
+def run_preview(seconds, worker=None):
+    """Run the emulated preview loop, returns (fps, p95 frame time in ms)."""
+    raw_frame = np.random.randint(0, 256, FRAME_SHAPE[:2] + (4,), dtype=np.uint8)
+    frame_times = []
+    last = time.perf_counter()
+    end = last + seconds
+    while last < end:
+        preview_frame(raw_frame, worker)
+        time.sleep(FRAME_INTERVAL)
+        now = time.perf_counter()
+        frame_times.append(now - last)
+        last = now
+    frame_times = np.array(frame_times)
+    return 1.0 / frame_times.mean(), np.percentile(frame_times, 95) * 1000
+
+def thread_load(archive_dir, stop_flag):
+    """Classification load in a thread of the preview process."""
+    archive = CaptureArchive(archive_dir)
+    frame = np.random.randint(0, 256, FRAME_SHAPE, dtype=np.uint8)
+    while not stop_flag:
+        buffer = io.BytesIO()
+        Image.fromarray(frame).save(buffer, format="JPEG", quality=90)
+        archive.store(buffer.getvalue())
+        cpu_bound_classify()
+    archive.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview FPS under concurrent classification load.")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each scenario")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as archive_dir:
+        results["no load"] = run_preview(args.seconds)
+
+        stop_flag = []
+        load = Thread(target=thread_load, args=(archive_dir, stop_flag), daemon=True)
+        load.start()
+        results["thread load"] = run_preview(args.seconds)
+        stop_flag.append(True)
+        load.join()
+
+        # Keep the worker process busy: submit a new frame as soon as one is done.
+        completed = []
+        def on_result(reply, context):
+            completed.append(reply)
+            worker.submit()
+        worker = ClassificationWorker(archive_dir, on_result, classify=cpu_bound_classify)
+        worker.write_frame(np.zeros(FRAME_SHAPE, dtype=np.uint8))
+        worker.submit()
+        results["process load"] = run_preview(args.seconds, worker)
+        worker.stop()
+
+    print(f"{'scenario':<16}{'fps':>8}{'p95 frame ms':>15}")
+    for scenario, (fps, p95) in results.items():
+        print(f"{scenario:<16}{fps:>8.1f}{p95:>15.1f}")
+    print(f"Worker process completed {len(completed)} classifications.")
+
+if __name__ == "__main__":
+    main()
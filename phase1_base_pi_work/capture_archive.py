@@ -0,0 +1,276 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from PIL import Image
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Root folder of the archive. Images and thumbnails are stored under their
+# SHA-256 hash in two levels of shard folders (e.g. images/3f/a2/3fa2....jpg),
+# so no single folder ever holds thousands of files on the SD card.
+ARCHIVE_DIR = "capture_archive"
+INDEX_FILENAME = "index.sqlite3"
+
+# Thumbnails are generated once when an image is first stored.
+THUMBNAIL_SIZE = (80, 60)
+THUMBNAIL_QUALITY = 70
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    category TEXT,
+    waste_type INTEGER,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS captures_ts ON captures(ts);
+CREATE INDEX IF NOT EXISTS captures_category_ts ON captures(category, ts);
+"""
+
+# -----------------------------------------------------------------------------
+# Capture Archive
+# -----------------------------------------------------------------------------
+class CaptureArchive:
+    """
+    Content-addressed store for captured images with an SQLite index.
+
+    Identical images are only written once, every capture gets its own row in
+    the index with the timestamp, hash and (once known) classification result.
+    All queries and pruning go through the index, the image folders are never
+    scanned.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # The gpiozero callbacks run on their own threads, so one connection is
+        # shared behind a lock instead of being bound to the creating thread.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(root, INDEX_FILENAME), check_same_thread=False)
+        # WAL with relaxed syncing keeps the number of SD card flushes down.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    # -------------------------------------------------------------------------
+    # Paths
+    # -------------------------------------------------------------------------
+    def _sharded_path(self, kind, image_hash):
+        return os.path.join(self.root, kind, image_hash[:2], image_hash[2:4], f"{image_hash}.jpg")
+
+    def image_path(self, image_hash):
+        return self._sharded_path("images", image_hash)
+
+    def thumbnail_path(self, image_hash):
+        return self._sharded_path("thumbs", image_hash)
+
+    def _write_file(self, path, data):
+        """Write via a temporary file so a power cut never leaves half an image."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as output_file:
+            output_file.write(data)
+        os.replace(temp_path, path)
+
+    # -------------------------------------------------------------------------
+    # Storing
+    # -------------------------------------------------------------------------
+    def store(self, jpeg_bytes, timestamp=None):
+        """
+        Store a captured JPEG and add it to the index.
+
+        Returns (capture_id, image_hash). If the same image was stored before,
+        only a new index row is added.
+        """
+        image_hash = hashlib.sha256(jpeg_bytes).hexdigest()
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self.lock:
+            row = self.db.execute("SELECT refs FROM blobs WHERE hash = ?", (image_hash,)).fetchone()
+            if row is None:
+                self._write_file(self.image_path(image_hash), jpeg_bytes)
+                self._write_thumbnail(image_hash, jpeg_bytes)
+                self.db.execute("INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1)",
+                                (image_hash, len(jpeg_bytes)))
+            else:
+                self.db.execute("UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (image_hash,))
+            cursor = self.db.execute("INSERT INTO captures (ts, hash) VALUES (?, ?)",
+                                     (timestamp, image_hash))
+            self.db.commit()
+        return cursor.lastrowid, image_hash
+
+    def _write_thumbnail(self, image_hash, jpeg_bytes):
+        image = Image.open(io.BytesIO(jpeg_bytes))
+        # draft() lets the JPEG decoder downscale while decoding, much cheaper
+        # than decoding the full image and resizing it afterwards.
+        image.draft("RGB", THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE)
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+        self._write_file(self.thumbnail_path(image_hash), buffer.getvalue())
+
+    def record_result(self, capture_id, category, waste_type, latency_ms):
+        """Link the classification result and button-to-result latency to a capture."""
+        with self.lock:
+            self.db.execute("UPDATE captures SET category = ?, waste_type = ?, latency_ms = ? WHERE id = ?",
+                            (category, waste_type, latency_ms, capture_id))
+            self.db.commit()
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+    def query(self, start=None, end=None, category=None, limit=None):
+        """
+        Return captures as dicts, newest first, filtered by a unix timestamp
+        range and/or category. Served entirely from the indexes.
+        """
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("ts < ?")
+            params.append(end)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        sql = "SELECT id, ts, hash, category, waste_type, latency_ms FROM captures"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        columns = ("id", "ts", "hash", "category", "waste_type", "latency_ms")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def count_by_category(self, start=None, end=None):
+        """Number of captures per category in a time range."""
+        sql = "SELECT category, COUNT(*) FROM captures WHERE ts >= ? AND ts < ? GROUP BY category"
+        with self.lock:
+            rows = self.db.execute(sql, (start or 0, end or float("inf"))).fetchall()
+        return dict(rows)
+
+    # -------------------------------------------------------------------------
+    # Retention and Export
+    # -------------------------------------------------------------------------
+    def prune(self, max_age_days):
+        """
+        Remove captures older than max_age_days. Only the expired index rows are
+        visited, and image files are deleted once no capture refers to them.
+        Returns (removed_captures, removed_images).
+        """
+        cutoff = time.time() - max_age_days * 86400
+        with self.lock:
+            expired = self.db.execute("SELECT hash, COUNT(*) FROM captures WHERE ts < ? GROUP BY hash",
+                                      (cutoff,)).fetchall()
+            removed_captures = self.db.execute("DELETE FROM captures WHERE ts < ?", (cutoff,)).rowcount
+            orphans = []
+            for image_hash, count in expired:
+                self.db.execute("UPDATE blobs SET refs = refs - ? WHERE hash = ?", (count, image_hash))
+                refs = self.db.execute("SELECT refs FROM blobs WHERE hash = ?", (image_hash,)).fetchone()[0]
+                if refs <= 0:
+                    orphans.append(image_hash)
+            self.db.executemany("DELETE FROM blobs WHERE hash = ?", [(image_hash,) for image_hash in orphans])
+            self.db.commit()
+
+        for image_hash in orphans:
+            for path in (self.image_path(image_hash), self.thumbnail_path(image_hash)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return removed_captures, len(orphans)
+
+    def export(self, destination, start=None, end=None, category=None):
+        """
+        Export classified captures for retraining: one folder per category plus
+        a manifest.csv. Files are hard linked when possible so nothing is copied
+        on the SD card. Returns the number of exported images.
+        """
+        captures = [c for c in self.query(start, end, category) if c["category"]]
+        os.makedirs(destination, exist_ok=True)
+        exported = set()
+        with open(os.path.join(destination, "manifest.csv"), "w", newline="") as manifest_file:
+            writer = csv.writer(manifest_file)
+            writer.writerow(["file", "category", "waste_type", "timestamp", "latency_ms"])
+            for capture in captures:
+                relative_path = os.path.join(capture["category"], f"{capture['hash']}.jpg")
+                writer.writerow([relative_path, capture["category"], capture["waste_type"],
+                                 capture["ts"], capture["latency_ms"]])
+                if relative_path in exported:
+                    continue
+                target = os.path.join(destination, relative_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if not os.path.exists(target):
+                    try:
+                        os.link(self.image_path(capture["hash"]), target)
+                    except OSError:
+                        shutil.copy2(self.image_path(capture["hash"]), target)
+                exported.add(relative_path)
+        return len(exported)
+
+# -----------------------------------------------------------------------------
+# Command Line
+# -----------------------------------------------------------------------------
+def parse_date(value):
+    """Turn a YYYY-MM-DD string into a unix timestamp (local time)."""
+    return datetime.strptime(value, "%Y-%m-%d").timestamp() if value else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query and maintain the capture archive.")
+    parser.add_argument("--root", default=ARCHIVE_DIR, help="archive folder")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="list captures")
+    export_parser = subparsers.add_parser("export", help="export captures for retraining")
+    export_parser.add_argument("destination")
+    for sub in (list_parser, export_parser):
+        sub.add_argument("--since", help="start date, YYYY-MM-DD")
+        sub.add_argument("--until", help="end date (exclusive), YYYY-MM-DD")
+        sub.add_argument("--category", help="only this waste category")
+    list_parser.add_argument("--limit", type=int, default=50)
+
+    prune_parser = subparsers.add_parser("prune", help="remove old captures")
+    prune_parser.add_argument("--days", type=float, required=True, help="keep captures newer than this")
+
+    args = parser.parse_args()
+    archive = CaptureArchive(args.root)
+    try:
+        if args.command == "list":
+            for capture in archive.query(parse_date(args.since), parse_date(args.until),
+                                         args.category, args.limit):
+                when = datetime.fromtimestamp(capture["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+                latency = f"{capture['latency_ms']:.0f} ms" if capture["latency_ms"] is not None else "-"
+                print(f"{when}  {capture['hash'][:12]}  {capture['category'] or 'unclassified':<12} {latency}")
+        elif args.command == "export":
+            count = archive.export(args.destination, parse_date(args.since),
+                                   parse_date(args.until), args.category)
+            print(f"Exported {count} images to {args.destination}")
+        elif args.command == "prune":
+            captures, images = archive.prune(args.days)
+            print(f"Removed {captures} captures and {images} images.")
+    finally:
+        archive.close()
@@ -0,0 +1,204 @@
+import io
+import queue
+import time
+import multiprocessing
+from threading import Thread
+from PIL import Image
+
+from capture_archive import CaptureArchive
+from frame_ring import FrameRing
+from inference_router import InferenceRouter
+from waste_client import REQUEST_TIMEOUT, simulate_api_call
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Frames kept in the shared ring. At ~20 preview FPS this gives the worker
+# 400 ms to pick up a captured frame before it is overwritten.
+RING_SLOTS = 8
+FRAME_SHAPE = (240, 320, 3)
+JPEG_QUALITY = 90
+
+# A request without a reply after this long is reported as timed out, so a
+# stuck or dead worker cannot keep the bin in "classifying" forever. The
+# inference request itself may take REQUEST_TIMEOUT, plus encoding and
+# archiving.
+REPLY_TIMEOUT_SECONDS = REQUEST_TIMEOUT + 10
+
+# -----------------------------------------------------------------------------
+# Worker Process
+# -----------------------------------------------------------------------------
+def encode_frame(ring, seq):
+    """
+    JPEG encode a frame straight from shared memory. If the frame was
+    overwritten in the meantime, fall back to the newest frame in the ring.
+    Returns (jpeg_bytes, seq_used).
+    """
+    for candidate in (seq, ring.latest_seq()):
+        frame = ring.view(candidate)
+        if frame is None:
+            continue
+        buffer = io.BytesIO()
+        Image.fromarray(frame).save(buffer, format="JPEG", quality=JPEG_QUALITY)
+        if ring.is_valid(candidate):
+            return buffer.getvalue(), candidate
+        print(f"Frame {candidate} was overwritten while encoding, retrying.")
+    raise RuntimeError(f"Frame {seq} is no longer available")
+
+def worker_main(ring_name, control_queue, result_queue, archive_dir, classify=simulate_api_call,
+                inference_urls=None):
+    """
+    Entry point of the classification process: waits for capture requests,
+    encodes and archives the frame, classifies it and posts the result back.
+    With inference_urls the frame is sent to the inference machines through
+    an InferenceRouter that lives in this process, otherwise classify() is
+    called.
+    """
+    ring = FrameRing.attach(ring_name, RING_SLOTS, FRAME_SHAPE)
+    archive = CaptureArchive(archive_dir)
+    router = InferenceRouter(inference_urls) if inference_urls else None
+    print(f"Classification worker started (pid {multiprocessing.current_process().pid}).")
+    try:
+        while True:
+            message = control_queue.get()
+            if message["type"] == "stop":
+                break
+            if message["type"] != "classify":
+                continue
+
+            stages = {}
+            reply = {"request_id": message["request_id"], "stages": stages}
+            try:
+                stage_start = time.perf_counter()
+                jpeg_bytes, seq = encode_frame(ring, message["seq"])
+                stages["encode"] = time.perf_counter() - stage_start
+                reply["jpeg_size"] = len(jpeg_bytes)
+
+                stage_start = time.perf_counter()
+                capture_id, image_hash = archive.store(jpeg_bytes)
+                stages["archive"] = time.perf_counter() - stage_start
+
+                stage_start = time.perf_counter()
+                if router:
+                    response = router.classify(jpeg_bytes)
+                    result_name = response["waste_category"]
+                    result_number = response["waste_type"]
+                    reply.update(waste_name=response.get("waste_name"), timing=response["timing"],
+                                 routing=response["routing"])
+                else:
+                    result_name, result_number = classify()
+                stages["classify"] = time.perf_counter() - stage_start
+
+                # time.monotonic() is system wide, so the press time from the
+                # camera process can be compared directly.
+                latency_ms = (time.monotonic() - message["press_time"]) * 1000
+                archive.record_result(capture_id, result_name, result_number, latency_ms)
+                reply.update(ok=True, result_name=result_name, result_number=result_number,
+                             image_hash=image_hash, latency_ms=latency_ms)
+            except Exception as e:
+                reply.update(ok=False, error=str(e),
+                             outcome="timeout" if isinstance(e, TimeoutError) else "failure")
+            result_queue.put(reply)
+    finally:
+        if router:
+            router.close()
+        archive.close()
+        ring.close()
+
+# -----------------------------------------------------------------------------
+# Camera Process Side
+# -----------------------------------------------------------------------------
+class ClassificationWorker:
+    """
+    Owns the frame ring and the classification process.
+
+    The camera process writes every preview frame into the ring and only sends
+    the sequence number of the captured frame over the control queue. Results
+    come back on the result queue and are handed to on_result from a listener
+    thread. If the worker process dies or a reply takes longer than
+    REPLY_TIMEOUT_SECONDS, on_result gets a failed reply instead.
+    """
+
+    def __init__(self, archive_dir, on_result, classify=simulate_api_call, inference_urls=None):
+        # spawn instead of fork: the camera process holds GPIO, SPI and camera
+        # handles that must not be duplicated into the child.
+        context = multiprocessing.get_context("spawn")
+        self.ring = FrameRing.create(RING_SLOTS, FRAME_SHAPE)
+        self.control_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.on_result = on_result
+        self.pending = {}
+        self.next_request_id = 1
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.ring.name, self.control_queue, self.result_queue, archive_dir, classify,
+                  list(inference_urls or [])),
+            daemon=True)
+        self.process.start()
+        self.listener = Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def write_frame(self, frame):
+        return self.ring.write(frame)
+
+    def slot_for_writing(self):
+        """(seq, array) of the next ring slot, to be filled in place and then published."""
+        return self.ring.slot_for_writing()
+
+    def publish(self, seq):
+        self.ring.publish(seq)
+
+    def submit(self, seq=None, context=None):
+        """Ask the worker to classify a frame (the newest one by default)."""
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self.pending[request_id] = (context, time.monotonic())
+        self.control_queue.put({
+            "type": "classify",
+            "request_id": request_id,
+            "seq": self.ring.latest_seq() if seq is None else seq,
+            "press_time": time.monotonic(),
+        })
+        return request_id
+
+    def queue_depth(self):
+        return len(self.pending)
+
+    def _listen(self):
+        while True:
+            try:
+                reply = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                self._fail_lost_requests()
+                continue
+            if reply is None:
+                break
+            entry = self.pending.pop(reply["request_id"], None)
+            if entry is None:
+                # Already reported as timed out.
+                print(f"Late reply for request {reply['request_id']} ignored.")
+                continue
+            self.on_result(reply, entry[0])
+
+    def _fail_lost_requests(self):
+        """Report requests the worker will not answer (dead process or reply timeout)."""
+        alive = self.process.is_alive()
+        now = time.monotonic()
+        for request_id, (context, submitted) in list(self.pending.items()):
+            if alive and now - submitted < REPLY_TIMEOUT_SECONDS:
+                continue
+            del self.pending[request_id]
+            if alive:
+                reply = {"outcome": "timeout", "error": f"No reply from the worker after {REPLY_TIMEOUT_SECONDS} s"}
+            else:
+                reply = {"outcome": "failure",
+                         "error": f"Classification worker died (exit code {self.process.exitcode})"}
+            reply.update(request_id=request_id, stages={}, ok=False)
+            self.on_result(reply, context)
+
+    def stop(self):
+        self.control_queue.put({"type": "stop"})
+        self.process.join(timeout=5)
+        self.result_queue.put(None)
+        self.listener.join(timeout=2)
+        self.ring.close()
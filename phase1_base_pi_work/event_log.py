@@ -0,0 +1,399 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+EVENT_LOG_DIR = "event_log"
+
+# One fixed-width record per event, 20 bytes. Segments are plain arrays of
+# these after a 16 byte header, so they can be memory-mapped as they are.
+EVENT_DTYPE = np.dtype([
+    ("ts", "<f8"),           # unix time
+    ("kind", "u1"),          # PRESS, CAPTURE, RESULT, FAILURE or STAGE
+    ("code", "u1"),          # button, waste_type, failure outcome or stage
+    ("bin_id", "<u2"),       # which bin wrote the event
+    ("duration_ms", "<f4"),  # capture, stage or button-to-result time
+    ("value", "<u4"),        # JPEG bytes of a capture
+])
+
+SEGMENT_MAGIC = b"WBEVLOG1"
+HEADER_SIZE = 16
+
+# A new segment is started every day, or earlier when one gets this big.
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+
+# Events are collected in memory and written by a background thread, so the
+# button path only copies a few numbers into an array.
+FLUSH_SECONDS = 5
+BUFFER_RECORDS = 256
+
+# Event kinds.
+PRESS = 1
+CAPTURE = 2
+RESULT = 3
+FAILURE = 4
+STAGE = 5
+
+BUTTONS = {"start": 1, "capture": 2}
+FAILURE_OUTCOMES = {"failure": 1, "timeout": 2}
+# Stage codes, the index in this tuple (0 for anything else).
+STAGES = ("other", "capture_still", "encode", "archive", "classify")
+
+# Latencies are sorted as group * PERCENTILE_SPAN + milliseconds, so they
+# are capped at about 4.6 hours.
+PERCENTILE_SPAN = 2 ** 24
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# waste_type numbers as sent by llm_processor.py (0 = Unknown).
+CATEGORY_NAMES = ("Unknown", "Rubbish", "Recyclable", "Organics", "EcoWaste")
+
+# -----------------------------------------------------------------------------
+# Segments
+# -----------------------------------------------------------------------------
+def segment_header():
+    return SEGMENT_MAGIC + EVENT_DTYPE.itemsize.to_bytes(2, "little") + bytes(HEADER_SIZE - len(SEGMENT_MAGIC) - 2)
+
+def open_segment(path):
+    """Memory-map a segment. A partly written last record is ignored."""
+    with open(path, "rb") as segment_file:
+        header = segment_file.read(HEADER_SIZE)
+    if header[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC or int.from_bytes(header[8:10], "little") != EVENT_DTYPE.itemsize:
+        raise ValueError(f"{path} is not an event log segment of this version")
+    count = (os.path.getsize(path) - HEADER_SIZE) // EVENT_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    return np.memmap(path, dtype=EVENT_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+def segment_day(filename):
+    """The day in a segment name like events-20250131-000.bin, or None."""
+    try:
+        return datetime.strptime(filename.split("-")[1], "%Y%m%d").date()
+    except (IndexError, ValueError):
+        return None
+
+def load_events(root=EVENT_LOG_DIR, since=None, until=None):
+    """
+    All events with since <= ts < until (unix times, both optional) from the
+    segments in root, as one structured array.
+    """
+    arrays = []
+    for filename in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        day = segment_day(filename)
+        if day is None or not filename.endswith(".bin"):
+            continue
+        # Segment names only tell when a segment was started, allow a day of slack.
+        day_start = time.mktime(day.timetuple())
+        if (since is not None and day_start + 2 * 86400 <= since) or (until is not None and day_start - 86400 >= until):
+            continue
+        segment = open_segment(os.path.join(root, filename))
+        if since is not None or until is not None:
+            mask = np.ones(len(segment), dtype=bool)
+            if since is not None:
+                mask &= segment["ts"] >= since
+            if until is not None:
+                mask &= segment["ts"] < until
+            segment = segment[mask]
+        arrays.append(segment)
+    if not arrays:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    return np.concatenate(arrays)
+
+# -----------------------------------------------------------------------------
+# Event Log Writer
+# -----------------------------------------------------------------------------
+class EventLog:
+    """
+    Append-only log of presses, captures, classification results, failures
+    and stage timings, in daily binary segments of fixed-width records.
+    """
+
+    def __init__(self, root=EVENT_LOG_DIR, bin_id=0):
+        self.root = root
+        self.bin_id = bin_id
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.buffer = np.zeros(BUFFER_RECORDS, dtype=EVENT_DTYPE)
+        self.count = 0
+        self.full_buffers = []
+        self.segment_path = None
+        self.segment_day = None
+        self.flush_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._flush_loop, name="event-log", daemon=True)
+        self.thread.start()
+
+    # -- Recording (called from the button path, must stay cheap) -----------
+    def _append(self, kind, code, duration_ms=0.0, value=0):
+        with self.lock:
+            self.buffer[self.count] = (time.time(), kind, code, self.bin_id, duration_ms, value)
+            self.count += 1
+            if self.count == BUFFER_RECORDS:
+                self.full_buffers.append(self.buffer)
+                self.buffer = np.zeros(BUFFER_RECORDS, dtype=EVENT_DTYPE)
+                self.count = 0
+                self.flush_event.set()
+
+    def press(self, button):
+        """A press of the "start" or "capture" button."""
+        self._append(PRESS, BUTTONS.get(button, 0))
+
+    def capture(self, jpeg_bytes, capture_ms):
+        self._append(CAPTURE, 0, capture_ms, jpeg_bytes)
+
+    def result(self, waste_type, latency_ms):
+        """A classification result with its button-to-result time."""
+        self._append(RESULT, waste_type if 0 <= waste_type < len(CATEGORY_NAMES) else 0, latency_ms)
+
+    def failure(self, outcome, latency_ms=0.0):
+        """A classification that failed ("failure") or timed out ("timeout")."""
+        self._append(FAILURE, FAILURE_OUTCOMES.get(outcome, 0), latency_ms)
+
+    def stage(self, name, seconds):
+        self._append(STAGE, STAGES.index(name) if name in STAGES else 0, seconds * 1000)
+
+    # -- Writing --------------------------------------------------------------
+    def _segment_for(self, now):
+        """The segment to append to, starting a new one each day or when full."""
+        day = time.strftime("%Y%m%d", time.localtime(now))
+        if (self.segment_path is not None and day == self.segment_day
+                and os.path.getsize(self.segment_path) < SEGMENT_MAX_BYTES):
+            return self.segment_path
+        sequence = 0
+        while True:
+            path = os.path.join(self.root, f"events-{day}-{sequence:03d}.bin")
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < HEADER_SIZE:
+                with open(path, "wb") as segment_file:
+                    segment_file.write(segment_header())
+                break
+            if size < SEGMENT_MAX_BYTES:
+                # Continue the segment of an earlier run on the same day. A
+                # power cut can leave a partly written last record, cut it off
+                # so the new records stay aligned.
+                torn = (size - HEADER_SIZE) % EVENT_DTYPE.itemsize
+                if torn:
+                    os.truncate(path, size - torn)
+                break
+            sequence += 1
+        self.segment_path = path
+        self.segment_day = day
+        return path
+
+    def flush(self):
+        """Write all buffered events to the current segment."""
+        with self.lock:
+            pending = self.full_buffers
+            if self.count:
+                pending.append(self.buffer[:self.count].copy())
+            self.full_buffers = []
+            self.count = 0
+        if not pending:
+            return
+        records = np.concatenate(pending)
+        try:
+            with open(self._segment_for(time.time()), "ab") as segment_file:
+                segment_file.write(records.tobytes())
+        except OSError as e:
+            # The write may have stopped part way, the segment is checked
+            # again before the next one.
+            self.segment_path = None
+            print(f"Could not write {len(records)} events: {e}")
+
+    def _flush_loop(self):
+        while not self.stop_event.is_set():
+            self.flush_event.wait(FLUSH_SECONDS)
+            self.flush_event.clear()
+            self.flush()
+
+    def close(self):
+        self.stop_event.set()
+        self.flush_event.set()
+        self.thread.join(timeout=2)
+        self.flush()
+
+# -----------------------------------------------------------------------------
+# Daily Statistics
+# -----------------------------------------------------------------------------
+def grouped_percentile(values, groups, group_count, percent):
+    """
+    Percentile of non-negative values within each group, NaN for empty
+    groups. One sort of group * PERCENTILE_SPAN + value orders the values of
+    every group at once, which is much faster than np.lexsort.
+    """
+    result = np.full(group_count, np.nan)
+    if len(values) == 0:
+        return result
+    keys = np.sort(groups * PERCENTILE_SPAN + np.clip(values, 0, PERCENTILE_SPAN - 1))
+    sorted_groups = (keys // PERCENTILE_SPAN).astype(np.int64)
+    starts = np.searchsorted(sorted_groups, np.arange(group_count), side="left")
+    ends = np.searchsorted(sorted_groups, np.arange(group_count), side="right")
+    filled = ends > starts
+    positions = starts + np.floor((ends - starts - 1) * percent / 100).astype(np.int64)
+    result[filled] = keys[positions[filled]] - np.arange(group_count)[filled] * PERCENTILE_SPAN
+    return result
+
+def local_utc_offsets(timestamps):
+    """
+    The local UTC offset in seconds at every timestamp, so days are split at
+    local midnight on both sides of a daylight saving change. The offset is
+    looked up once per hour of the covered range, not once per event.
+    """
+    hours = timestamps.astype(np.int64) // 3600
+    first_hour = int(hours.min())
+    offsets = np.array([time.localtime(hour * 3600).tm_gmtoff
+                        for hour in range(first_hour, int(hours.max()) + 1)], dtype=np.int64)
+    return offsets[hours - first_hour]
+
+def daily_summary(events):
+    """
+    Per bin and local day: presses, captures, results per category, failures,
+    failure rate, latency (mean, p50, p95) and mean stage times. Everything is
+    computed with vectorized numpy over the whole event array.
+    """
+    if len(events) == 0:
+        return []
+    seconds = events["ts"].astype(np.int64)
+    days = (seconds + local_utc_offsets(seconds)) // 86400
+    first_day = days.min()
+    # Group number straight from (day, bin), no sorting needed. Groups
+    # without events are dropped at the end.
+    bin_count = int(events["bin_id"].max()) + 1
+    groups = (days - first_day) * bin_count + events["bin_id"]
+    group_count = int(groups.max()) + 1
+    kinds = events["kind"]
+    codes = events["code"].astype(np.int64)
+    durations = events["duration_ms"].astype(np.float64)
+
+    def count(kind):
+        return np.bincount(groups[kinds == kind], minlength=group_count)
+
+    is_result = kinds == RESULT
+    result_groups = groups[is_result]
+    categories = np.bincount(result_groups * len(CATEGORY_NAMES) + codes[is_result],
+                             minlength=group_count * len(CATEGORY_NAMES)).reshape(group_count, len(CATEGORY_NAMES))
+    results = categories.sum(axis=1)
+    failures = count(FAILURE)
+    latencies = durations[is_result]
+    latency_mean = np.bincount(result_groups, weights=latencies, minlength=group_count) / np.maximum(results, 1)
+    latency_p50 = grouped_percentile(latencies, result_groups, group_count, 50)
+    latency_p95 = grouped_percentile(latencies, result_groups, group_count, 95)
+
+    is_stage = kinds == STAGE
+    stage_keys = groups[is_stage] * len(STAGES) + codes[is_stage]
+    stage_counts = np.bincount(stage_keys, minlength=group_count * len(STAGES)).reshape(group_count, len(STAGES))
+    stage_totals = np.bincount(stage_keys, weights=durations[is_stage],
+                               minlength=group_count * len(STAGES)).reshape(group_count, len(STAGES))
+    stage_means = stage_totals / np.maximum(stage_counts, 1)
+
+    presses = count(PRESS)
+    captures = count(CAPTURE)
+    seen = np.bincount(groups, minlength=group_count)
+    summary = []
+    for group in np.flatnonzero(seen):
+        day = date.fromordinal(EPOCH_ORDINAL + int(first_day) + group // bin_count)
+        attempts = results[group] + failures[group]
+        summary.append({
+            "bin_id": int(group % bin_count),
+            "day": day.isoformat(),
+            "presses": int(presses[group]),
+            "captures": int(captures[group]),
+            "results": int(results[group]),
+            "categories": {name: int(categories[group, code]) for code, name in enumerate(CATEGORY_NAMES)},
+            "failures": int(failures[group]),
+            "failure_rate": failures[group] / attempts if attempts else 0.0,
+            "latency_mean_ms": float(latency_mean[group]) if results[group] else None,
+            "latency_p50_ms": None if np.isnan(latency_p50[group]) else float(latency_p50[group]),
+            "latency_p95_ms": None if np.isnan(latency_p95[group]) else float(latency_p95[group]),
+            "stage_mean_ms": {name: float(stage_means[group, code])
+                              for code, name in enumerate(STAGES) if stage_counts[group, code]},
+        })
+    return summary
+
+def print_summary(summary):
+    print(f"{'day':<12}{'bin':>4}{'press':>7}{'results':>8}" + "".join(f"{name[:7]:>9}" for name in CATEGORY_NAMES[1:])
+          + f"{'fail %':>8}{'mean ms':>9}{'p50 ms':>8}{'p95 ms':>8}")
+    for row in summary:
+        latency = [row[key] for key in ("latency_mean_ms", "latency_p50_ms", "latency_p95_ms")]
+        print(f"{row['day']:<12}{row['bin_id']:>4}{row['presses']:>7}{row['results']:>8}"
+              + "".join(f"{row['categories'][name]:>9}" for name in CATEGORY_NAMES[1:])
+              + f"{row['failure_rate'] * 100:>8.1f}"
+              + "".join(f"{'-' if value is None else f'{value:.0f}':>{width}}"
+                        for value, width in zip(latency, (9, 8, 8))))
+
+# -----------------------------------------------------------------------------
+# Benchmark
+# -----------------------------------------------------------------------------
+def synthetic_day(start, count, bin_id, rng):
+    """A day of made-up events with realistic proportions."""
+    records = np.zeros(count, dtype=EVENT_DTYPE)
+    records["ts"] = np.sort(start + rng.uniform(0, 86400, count))
+    records["kind"] = rng.choice([PRESS, CAPTURE, RESULT, FAILURE, STAGE], count, p=[0.2, 0.2, 0.17, 0.03, 0.4])
+    records["bin_id"] = bin_id
+    results = records["kind"] == RESULT
+    records["code"][results] = rng.integers(1, 5, results.sum())
+    records["duration_ms"][results] = rng.lognormal(np.log(2500), 0.3, results.sum())
+    stages = records["kind"] == STAGE
+    records["code"][stages] = rng.integers(1, len(STAGES), stages.sum())
+    records["duration_ms"][stages] = rng.lognormal(np.log(200), 0.8, stages.sum())
+    return records
+
+def benchmark(days=90, events_per_day=20000, bins=1):
+    """Time the logging calls and a daily summary over months of synthetic segments."""
+    # The timed logging calls go to their own folder, so they are not
+    # counted with the synthetic days.
+    log_root = tempfile.mkdtemp(prefix="event_log_calls_")
+    try:
+        event_log = EventLog(log_root)
+        calls = 100_000
+        start = time.perf_counter()
+        for _ in range(calls):
+            event_log.stage("classify", 0.1)
+        per_call = (time.perf_counter() - start) / calls
+        event_log.close()
+    finally:
+        shutil.rmtree(log_root)
+
+    root = tempfile.mkdtemp(prefix="event_log_")
+    try:
+        rng = np.random.default_rng(1)
+        first_day = time.mktime(datetime.now().date().timetuple()) - days * 86400
+        for day in range(days):
+            day_start = first_day + day * 86400
+            name = f"events-{time.strftime('%Y%m%d', time.localtime(day_start))}-000.bin"
+            with open(os.path.join(root, name), "wb") as segment_file:
+                segment_file.write(segment_header())
+                for bin_id in range(bins):
+                    segment_file.write(synthetic_day(day_start, events_per_day, bin_id, rng).tobytes())
+
+        start = time.perf_counter()
+        events = load_events(root, since=first_day)
+        loaded = time.perf_counter()
+        summary = daily_summary(events)
+        done = time.perf_counter()
+        print(f"Logging call: {per_call * 1e6:.1f} us")
+        print(f"{len(events):,} events over {days} days ({len(events) * EVENT_DTYPE.itemsize / 1e6:.0f} MB): "
+              f"loaded in {(loaded - start) * 1000:.0f} ms, summarized in {(done - loaded) * 1000:.0f} ms "
+              f"({len(summary)} bin-days)")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daily statistics from the bin's event log.")
+    parser.add_argument("--dir", default=EVENT_LOG_DIR, help="event log folder")
+    parser.add_argument("--days", type=int, default=30, help="number of days to summarize")
+    parser.add_argument("--benchmark", action="store_true", help="time logging and aggregation on synthetic data")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+    else:
+        since = time.mktime(datetime.now().date().timetuple()) - (args.days - 1) * 86400
+        print_summary(daily_summary(load_events(args.dir, since=since)))
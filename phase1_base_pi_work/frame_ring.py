@@ -0,0 +1,114 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Shared-Memory Frame Ring
+# -----------------------------------------------------------------------------
+class FrameRing:
+    """
+    A ring of fixed-size frames in shared memory, written by the camera process
+    and read by the classification process without pickling.
+
+    Layout of the shared block:
+      - latest sequence number written (uint64)
+      - one sequence number per slot (uint64)
+      - the frame slots themselves
+
+    Sequence numbers start at 1. While a slot is being written its sequence
+    number is set to 0, so a reader can tell a finished frame from one that is
+    being overwritten: read the slot number, use the frame, then check that the
+    slot number has not changed.
+    """
+
+    def __init__(self, shm, slots, shape, dtype, owner):
+        self.shm = shm
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        header = np.ndarray((slots + 1,), dtype=np.uint64, buffer=shm.buf)
+        self.latest = header[0:1]
+        self.slot_seq = header[1:]
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype,
+                                 buffer=shm.buf, offset=header.nbytes)
+        self.next_seq = int(self.latest[0]) + 1
+
+    @classmethod
+    def create(cls, slots=8, shape=(240, 320, 3), dtype=np.uint8, name=None):
+        """Allocate a new ring. The creating process is responsible for unlink()."""
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size = (slots + 1) * 8 + slots * frame_bytes
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        ring = cls(shm, slots, shape, dtype, owner=True)
+        ring.latest[0] = 0
+        ring.slot_seq[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, slots=8, shape=(240, 320, 3), dtype=np.uint8):
+        """Open a ring created by another process."""
+        return cls(shared_memory.SharedMemory(name=name), slots, shape, dtype, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # -------------------------------------------------------------------------
+    # Writer side (camera process only)
+    # -------------------------------------------------------------------------
+    def slot_for_writing(self):
+        """
+        Return (seq, array) for the next slot so the caller can fill it in place,
+        e.g. as the output of a colour conversion. Call publish(seq) afterwards.
+        """
+        seq = self.next_seq
+        slot = seq % self.slots
+        self.slot_seq[slot] = 0
+        return seq, self.frames[slot]
+
+    def publish(self, seq):
+        self.slot_seq[seq % self.slots] = seq
+        self.latest[0] = seq
+        self.next_seq = seq + 1
+
+    def write(self, frame):
+        """Copy a frame into the next slot and return its sequence number."""
+        seq, slot = self.slot_for_writing()
+        slot[...] = frame
+        self.publish(seq)
+        return seq
+
+    # -------------------------------------------------------------------------
+    # Reader side
+    # -------------------------------------------------------------------------
+    def latest_seq(self):
+        return int(self.latest[0])
+
+    def is_valid(self, seq):
+        """True while the frame with this sequence number is still in its slot."""
+        return seq > 0 and int(self.slot_seq[seq % self.slots]) == seq
+
+    def view(self, seq):
+        """
+        Zero-copy view of a frame, or None if it has already been overwritten.
+        The view changes when the writer comes round again, so check is_valid()
+        once done with it.
+        """
+        if not self.is_valid(seq):
+            return None
+        return self.frames[seq % self.slots]
+
+    def read(self, seq):
+        """Copy of a frame, or None if it was overwritten before or during the copy."""
+        frame = self.view(seq)
+        if frame is None:
+            return None
+        frame = frame.copy()
+        return frame if self.is_valid(seq) else None
+
+    def close(self):
+        # Drop the numpy views first, SharedMemory refuses to close while they exist.
+        self.latest = self.slot_seq = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
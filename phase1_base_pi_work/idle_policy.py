@@ -0,0 +1,152 @@
+import threading
+import time
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+ACTIVE = 0      # full preview rate, backlight on
+LOW_FPS = 1     # slower preview, motion check on the lores stream
+DIMMED = 2      # no LCD updates, slow sensor, dimmed backlight, motion check once a second
+DEEP = 3        # camera stopped, backlight off, only a button press wakes up
+
+# Stages where the preview is off the screen, so a button press only wakes the
+# bin up. In LOW_FPS the preview is still visible and a press works as usual.
+WAKE_UP_STAGES = (DIMMED, DEEP)
+
+STAGE_NAMES = {ACTIVE: "active", LOW_FPS: "low_fps", DIMMED: "dimmed", DEEP: "deep"}
+
+# Seconds without activity before each stage is entered.
+STAGE_AFTER_SECONDS = {LOW_FPS: 30, DIMMED: 120, DEEP: 600}
+
+# Time between loop iterations in each stage (DEEP blocks until woken up).
+LOOP_INTERVAL = {ACTIVE: 0.05, LOW_FPS: 0.25, DIMMED: 1.0, DEEP: None}
+
+# Backlight brightness (0.0 - 1.0) in each stage.
+BACKLIGHT_LEVEL = {ACTIVE: 1.0, LOW_FPS: 1.0, DIMMED: 0.1, DEEP: 0.0}
+
+# Target time from a button press or motion to the first full preview frame.
+RESUME_TARGET_SECONDS = 0.3
+
+# Mean absolute difference of the lores luminance (0-255) that counts as motion.
+MOTION_THRESHOLD = 6.0
+
+# How often CPU usage and wakeups per second are recomputed.
+MEASURE_WINDOW_SECONDS = 5.0
+
+# -----------------------------------------------------------------------------
+# Idle Policy
+# -----------------------------------------------------------------------------
+class IdlePolicy:
+    """
+    Steps the preview down through the idle stages after inactivity and wakes it
+    up again on a button press or motion.
+
+    The preview loop calls update() once per iteration to learn the current
+    stage and wait() to sleep until the next one. Button callbacks call
+    activity(), which also interrupts wait() so the loop resumes straight away.
+    It also measures the CPU usage and loop wakeups per second of the current
+    stage and the resume latency.
+    """
+
+    def __init__(self):
+        self.stage = ACTIVE
+        self.last_activity = time.monotonic()
+        self.wake_event = threading.Event()
+        self.previous_luma = None
+        # Set when waking from idle, cleared once the first frame is shown.
+        self.resume_started = None
+        self.resume_reason = None
+        self.last_resume_seconds = None
+
+        self.window_start = time.monotonic()
+        self.window_cpu = time.process_time()
+        self.window_wakeups = 0
+        self.cpu_percent = 0.0
+        self.wakeups_per_second = 0.0
+
+    def reset(self):
+        """Start over in the active stage, e.g. when the camera is started."""
+        self.stage = ACTIVE
+        self.last_activity = time.monotonic()
+        self.resume_started = None
+        self.previous_luma = None
+
+    def activity(self, reason):
+        """
+        Record user activity. Returns the stage the bin was in, so callers can
+        tell a wake-up press (a stage in WAKE_UP_STAGES) from a normal one.
+        """
+        now = time.monotonic()
+        previous = self.stage
+        self.last_activity = now
+        if previous != ACTIVE and self.resume_started is None:
+            self.resume_started = now
+            self.resume_reason = reason
+        self.wake_event.set()
+        return previous
+
+    def wake(self):
+        """Interrupt wait() without counting as activity (e.g. to stop the loop)."""
+        self.wake_event.set()
+
+    def update(self, hold=False):
+        """
+        Return the stage for this loop iteration. With hold=True (e.g. while
+        classifying) the bin is kept active.
+        """
+        now = time.monotonic()
+        if hold:
+            self.last_activity = now
+        idle_seconds = now - self.last_activity
+        stage = ACTIVE
+        for candidate in (LOW_FPS, DIMMED, DEEP):
+            if idle_seconds >= STAGE_AFTER_SECONDS[candidate]:
+                stage = candidate
+        if stage == ACTIVE:
+            # Motion checks start from a fresh reference next time we go idle.
+            self.previous_luma = None
+        self.stage = stage
+        self._measure(now)
+        return stage
+
+    def wait(self):
+        """Sleep until the next iteration of the current stage, or until woken up."""
+        self.wake_event.wait(LOOP_INTERVAL[self.stage])
+        self.wake_event.clear()
+
+    def motion_detected(self, luma):
+        """Compare a lores luminance frame with the previous one."""
+        luma = luma.astype(np.int16)
+        previous = self.previous_luma
+        self.previous_luma = luma
+        if previous is None or previous.shape != luma.shape:
+            return False
+        return float(np.abs(luma - previous).mean()) > MOTION_THRESHOLD
+
+    def frame_shown(self):
+        """
+        Called after a full preview frame reached the LCD. Returns the resume
+        latency in seconds if this frame completed a wake-up, otherwise None.
+        """
+        if self.resume_started is None:
+            return None
+        latency = time.monotonic() - self.resume_started
+        self.last_resume_seconds = latency
+        self.resume_started = None
+        if latency > RESUME_TARGET_SECONDS:
+            print(f"Resume after {self.resume_reason} took {latency * 1000:.0f} ms "
+                  f"(target {RESUME_TARGET_SECONDS * 1000:.0f} ms).")
+        return latency
+
+    def _measure(self, now):
+        self.window_wakeups += 1
+        elapsed = now - self.window_start
+        if elapsed < MEASURE_WINDOW_SECONDS:
+            return
+        cpu = time.process_time()
+        self.cpu_percent = (cpu - self.window_cpu) / elapsed * 100
+        self.wakeups_per_second = self.window_wakeups / elapsed
+        self.window_start = now
+        self.window_cpu = cpu
+        self.window_wakeups = 0
@@ -0,0 +1,351 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import waste_client
+from waste_client import CancelToken, RequestCancelled
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# How often every endpoint's GET /health is checked, and how long it may take.
+HEALTH_CHECK_SECONDS = 5
+HEALTH_TIMEOUT = 2
+
+# Smoothing factor for the latency average of each endpoint.
+EWMA_ALPHA = 0.3
+
+# Latency assumed for an endpoint before its first answer.
+INITIAL_LATENCY_MS = 3000
+
+# Recent request times kept per endpoint for the p95 hedging delay.
+LATENCY_WINDOW = 50
+
+# A hedge is only sent after this many answers, until then the delay is fixed.
+HEDGE_MIN_SAMPLES = 5
+INITIAL_HEDGE_DELAY_MS = 4000
+
+# A host whose request failed is only tried after the others for this long,
+# even if its health check still answers.
+FAILURE_BACKOFF_SECONDS = 30
+
+# A host's latency average only changes when it gets a request, so a host
+# that was slow once would never be chosen again after it recovered. Once it
+# was idle for this long, its average decays (halving the distance with
+# every half-life) toward its best recent time, or INITIAL_LATENCY_MS if that
+# is lower, until it is tried again.
+STALE_LATENCY_SECONDS = 60
+STALE_HALF_LIFE_SECONDS = 60
+
+# Never hedge sooner than this, so a burst of fast answers does not double
+# the load on the inference machines.
+MIN_HEDGE_DELAY_MS = 500
+
+def ewma(previous, value, alpha=EWMA_ALPHA):
+    return value if previous is None else previous + alpha * (value - previous)
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+# -----------------------------------------------------------------------------
+# Endpoints
+# -----------------------------------------------------------------------------
+class Endpoint:
+    """One inference machine running llm_processor.py, and what is known about it."""
+
+    def __init__(self, url):
+        self.url = url
+        target = urlsplit(url)
+        self.host = target.netloc
+        self.health_target = (target.hostname, target.port or 80)
+        self.healthy = True
+        self.server_active = 0
+        self.latency_ms = None
+        self.recent_ms = deque(maxlen=LATENCY_WINDOW)
+        self.in_flight = 0
+        self.requests = 0
+        self.wins = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.last_error = None
+        self.last_failure = None
+        self.last_used = None
+
+    def expected_latency(self, now):
+        """The latency average, decayed once it is stale (see STALE_LATENCY_SECONDS)."""
+        if self.latency_ms is None:
+            return INITIAL_LATENCY_MS
+        idle_seconds = now - self.last_used if self.last_used is not None else 0
+        if idle_seconds < STALE_LATENCY_SECONDS:
+            return self.latency_ms
+        target = min(min(self.recent_ms, default=INITIAL_LATENCY_MS), INITIAL_LATENCY_MS)
+        if self.latency_ms <= target:
+            return self.latency_ms
+        weight = 0.5 ** ((idle_seconds - STALE_LATENCY_SECONDS) / STALE_HALF_LIFE_SECONDS)
+        return target + (self.latency_ms - target) * weight
+
+    def cost(self, now):
+        """
+        Expected wait for a new request: the latency average, scaled by the
+        requests already running there (from this Pi and, as far as the last
+        health check knows, from other bins).
+        """
+        return self.expected_latency(now) * (1 + self.in_flight + self.server_active)
+
+    def recently_failed(self, now):
+        return self.last_failure is not None and now - self.last_failure < FAILURE_BACKOFF_SECONDS
+
+    def p95_ms(self):
+        if len(self.recent_ms) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(self.recent_ms, 95)
+
+    def report(self):
+        return {
+            "healthy": self.healthy, "latency_ewma_ms": self.latency_ms, "p95_ms": self.p95_ms(),
+            "in_flight": self.in_flight, "server_active": self.server_active, "requests": self.requests,
+            "wins": self.wins, "failures": self.failures, "cancelled": self.cancelled,
+            "last_error": self.last_error,
+        }
+
+# -----------------------------------------------------------------------------
+# Router
+# -----------------------------------------------------------------------------
+class InferenceRouter:
+    """
+    Sends every classification to the best of several inference machines.
+
+    A background thread checks GET /health on every endpoint. Requests go to
+    the healthy endpoint with the lowest expected wait (EWMA latency times the
+    requests in flight). If no answer arrived after that endpoint's p95
+    latency, the same request is also sent to the next best one (a hedge); the
+    first answer wins and the other request is cancelled. A request that fails
+    outright is retried on the next endpoint straight away. The latency
+    average of an endpoint that was not used for a while decays, so a host
+    that recovers is tried again without sending it extra requests.
+    """
+
+    def __init__(self, urls, timeout=waste_client.REQUEST_TIMEOUT):
+        if not urls:
+            raise ValueError("At least one inference URL is needed")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(urls), thread_name_prefix="inference")
+        self.stop_event = threading.Event()
+        self.health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self.health_thread.start()
+
+    # -- Health checks --------------------------------------------------------
+    def check_health(self, endpoint):
+        connection = http.client.HTTPConnection(*endpoint.health_target, timeout=HEALTH_TIMEOUT)
+        try:
+            connection.request("GET", "/health")
+            response = connection.getresponse()
+            data = json.loads(response.read())
+            healthy = response.status == 200 and data.get("status") == "ok"
+            error = None if healthy else f"HTTP {response.status}"
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            healthy, data, error = False, {}, str(e)
+        finally:
+            connection.close()
+
+        with self.lock:
+            if healthy != endpoint.healthy:
+                print(f"Inference host {endpoint.host} is {'back up' if healthy else 'down: ' + error}")
+            endpoint.healthy = healthy
+            endpoint.server_active = max(data.get("active_requests", 0) - endpoint.in_flight, 0) if healthy else 0
+            if error:
+                endpoint.last_error = error
+
+    def _health_loop(self):
+        while not self.stop_event.is_set():
+            for endpoint in self.endpoints:
+                self.check_health(endpoint)
+            self.stop_event.wait(HEALTH_CHECK_SECONDS)
+
+    # -- Routing --------------------------------------------------------------
+    def ranked(self):
+        """
+        Endpoints best first. Unhealthy ones and ones that recently failed are
+        only tried after all others.
+        """
+        now = time.monotonic()
+        with self.lock:
+            return sorted(self.endpoints, key=lambda endpoint: (
+                not endpoint.healthy, endpoint.recently_failed(now), endpoint.cost(now)))
+
+    def hedge_delay_ms(self, endpoint):
+        with self.lock:
+            p95 = endpoint.p95_ms()
+        return max(p95 if p95 is not None else INITIAL_HEDGE_DELAY_MS, MIN_HEDGE_DELAY_MS)
+
+    def _attempt(self, endpoint, jpeg_bytes, timeout, cancel_token):
+        with self.lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            # A stale average has decayed, so the new time is averaged with
+            # the decayed value rather than the old one.
+            now = time.monotonic()
+            if endpoint.latency_ms is not None:
+                endpoint.latency_ms = endpoint.expected_latency(now)
+            endpoint.last_used = now
+        start = time.perf_counter()
+        try:
+            response = waste_client.classify_image(jpeg_bytes, endpoint.url, timeout, cancel_token)
+        except RequestCancelled:
+            with self.lock:
+                endpoint.cancelled += 1
+                # It took at least this long, so a host that keeps losing
+                # hedges also loses its place as the first choice.
+                endpoint.latency_ms = ewma(endpoint.latency_ms, (time.perf_counter() - start) * 1000)
+            raise
+        except Exception as e:
+            with self.lock:
+                endpoint.failures += 1
+                endpoint.last_error = str(e)
+                endpoint.last_failure = time.monotonic()
+            raise
+        finally:
+            with self.lock:
+                endpoint.in_flight -= 1
+                endpoint.last_used = time.monotonic()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            endpoint.latency_ms = ewma(endpoint.latency_ms, elapsed_ms)
+            endpoint.recent_ms.append(elapsed_ms)
+            endpoint.healthy = True
+            endpoint.last_failure = None
+        return response
+
+    def classify(self, jpeg_bytes):
+        """
+        Classify a JPEG on the best endpoint. Returns the server's result dict
+        (see waste_client.classify_image) with an extra "routing" entry.
+        Raises the last error if no endpoint answered.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        candidates = self.ranked()
+        pending = {}
+        last_error = None
+        hedged = False
+
+        def launch(endpoint):
+            token = CancelToken()
+            timeout = max(deadline - time.monotonic(), 0.1)
+            future = self.executor.submit(self._attempt, endpoint, jpeg_bytes, timeout, token)
+            pending[future] = (endpoint, token)
+            # A hedge is sent if this endpoint is slower than usual.
+            return time.monotonic() + self.hedge_delay_ms(endpoint) / 1000
+
+        primary = candidates.pop(0)
+        hedge_at = launch(primary)
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake_at = deadline if hedged or not candidates else min(hedge_at, deadline)
+            done, _ = wait(pending, timeout=max(wake_at - now, 0), return_when=FIRST_COMPLETED)
+
+            if not done:
+                if not hedged and candidates and time.monotonic() >= hedge_at:
+                    # The primary is slower than its p95, ask a second host too.
+                    hedged = True
+                    launch(candidates.pop(0))
+                    with self.lock:
+                        self.hedges += 1
+                continue
+
+            for future in done:
+                endpoint, _ = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                # First answer wins, cancel whatever is still running.
+                for _, token in pending.values():
+                    token.cancel()
+                with self.lock:
+                    endpoint.wins += 1
+                    if endpoint is not primary:
+                        self.hedge_wins += 1
+                response["routing"] = {
+                    "host": endpoint.host, "hedged": hedged, "primary": primary.host,
+                    "total_ms": (time.monotonic() - start) * 1000,
+                }
+                return response
+
+            if not pending and candidates:
+                # Everything sent so far failed, fail over to the next host.
+                hedge_at = launch(candidates.pop(0))
+
+        for _, token in pending.values():
+            token.cancel()
+        if last_error is None:
+            raise TimeoutError(f"No inference host answered within {self.timeout} s")
+        raise last_error
+
+    def report(self):
+        with self.lock:
+            return {"hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                    "endpoints": {endpoint.host: endpoint.report() for endpoint in self.endpoints}}
+
+    def close(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# -----------------------------------------------------------------------------
+# Load Test
+# -----------------------------------------------------------------------------
+def load_test(urls, image_path, requests, interval):
+    """Send requests through the router (e.g. to stub_inference_server.py) and print where they went."""
+    with open(image_path, "rb") as image_file:
+        jpeg_bytes = image_file.read()
+    router = InferenceRouter(urls)
+    # Let the first health check finish.
+    time.sleep(0.5)
+    latencies = []
+    failures = 0
+    for number in range(requests):
+        try:
+            response = router.classify(jpeg_bytes)
+            routing = response["routing"]
+            latencies.append(routing["total_ms"])
+            print(f"{number + 1:>3}: {routing['host']:<22}{routing['total_ms']:>8.0f} ms"
+                  f"{'  (hedged from ' + routing['primary'] + ')' if routing['hedged'] else ''}")
+        except Exception as e:
+            failures += 1
+            print(f"{number + 1:>3}: failed: {e}")
+        time.sleep(interval)
+
+    report = router.report()
+    router.close()
+    if latencies:
+        print(f"p50 {percentile(latencies, 50):.0f} ms, p95 {percentile(latencies, 95):.0f} ms, "
+              f"{failures} failed, {report['hedges']} hedged ({report['hedge_wins']} won by the hedge)")
+    for host, endpoint in report["endpoints"].items():
+        latency = endpoint["latency_ewma_ms"]
+        print(f"  {host:<22}{'up' if endpoint['healthy'] else 'down':<6}"
+              f"ewma {'-' if latency is None else f'{latency:.0f} ms':<10}"
+              f"{endpoint['requests']} sent, {endpoint['wins']} won, {endpoint['failures']} failed, "
+              f"{endpoint['cancelled']} cancelled")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send test classifications through the inference router.")
+    parser.add_argument("urls", nargs="+", help="classification URLs, e.g. http://127.0.0.1:5001/classify")
+    parser.add_argument("--image", required=True, help="JPEG to send")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between requests")
+    args = parser.parse_args()
+    load_test(args.urls, args.image, args.requests, args.interval)
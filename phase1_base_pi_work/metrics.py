@@ -0,0 +1,195 @@
+import subprocess
+import time
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Port of the Prometheus endpoint, e.g. http://<pi>:8000/metrics
+METRICS_PORT = 8000
+
+# luma.lcd sends 3 bytes (RGB) per pixel to the ST7789 over SPI.
+SPI_BYTES_PER_PIXEL = 3
+
+# Smoothing factor for the FPS and SPI throughput gauges. Prometheus can also
+# compute rates from the counters, the gauges are for a quick look with curl.
+EWMA_ALPHA = 0.1
+
+# vcgencmd is slow (~10 ms), so its answer is reused for a few seconds.
+THROTTLE_CACHE_SECONDS = 5
+
+# Bits of "vcgencmd get_throttled" that are currently active.
+THROTTLE_FLAGS = {
+    0: "under_voltage",
+    1: "arm_frequency_capped",
+    2: "throttled",
+    3: "soft_temperature_limit",
+}
+
+# -----------------------------------------------------------------------------
+# Metrics
+# -----------------------------------------------------------------------------
+preview_frames = Counter("preview_frames_total", "Frames pushed to the LCD by the preview loop")
+preview_fps = Gauge("preview_fps", "Smoothed preview frames per second")
+preview_frame_seconds = Histogram(
+    "preview_frame_seconds", "Time between two preview frames",
+    buckets=(0.02, 0.04, 0.06, 0.08, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0))
+
+spi_bytes = Counter("display_spi_bytes_total", "Bytes sent to the LCD over SPI")
+spi_bytes_per_second = Gauge("display_spi_bytes_per_second", "Smoothed SPI throughput to the LCD")
+
+stage_seconds = Histogram(
+    "stage_seconds", "Duration of a single pipeline stage", ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+classification_latency_seconds = Histogram(
+    "classification_latency_seconds", "Time from capture button press to classification result",
+    buckets=(0.5, 1, 2, 3, 4, 5, 7.5, 10, 15, 20, 30))
+classifications = Counter("classifications_total", "Classification attempts by outcome", ["outcome"])
+classification_queue_depth = Gauge("classification_queue_depth", "Classifications waiting for a result")
+
+idle_stage = Gauge("idle_stage", "Current idle stage (0 active, 1 low fps, 2 dimmed, 3 deep)")
+idle_cpu_percent = Gauge("idle_cpu_percent", "Process CPU usage over the last measurement window")
+loop_wakeups_per_second = Gauge("loop_wakeups_per_second", "Preview loop iterations per second")
+idle_transitions = Counter("idle_transitions_total", "Changes into each idle stage", ["stage"])
+resume_latency_seconds = Histogram(
+    "resume_latency_seconds", "Time from wake-up (button or motion) to the first full preview frame",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0))
+
+# Create the outcome series up front so they show up as 0 before the first press.
+for outcome in ("success", "failure", "timeout"):
+    classifications.labels(outcome)
+
+# State for the smoothed gauges, only touched by the preview thread.
+smoothed_state = {"fps": None, "spi": None}
+
+# -----------------------------------------------------------------------------
+# Recording Helpers (called from the hot path, must stay cheap)
+# -----------------------------------------------------------------------------
+def record_preview_frame(frame_seconds, width, height):
+    """Record one frame of the preview loop and the SPI transfer it caused."""
+    frame_bytes = width * height * SPI_BYTES_PER_PIXEL
+    preview_frames.inc()
+    spi_bytes.inc(frame_bytes)
+    preview_frame_seconds.observe(frame_seconds)
+    if frame_seconds <= 0:
+        return
+
+    fps = 1.0 / frame_seconds
+    if smoothed_state["fps"] is None:
+        smoothed_state["fps"] = fps
+    else:
+        smoothed_state["fps"] += EWMA_ALPHA * (fps - smoothed_state["fps"])
+    smoothed_state["spi"] = smoothed_state["fps"] * frame_bytes
+    preview_fps.set(smoothed_state["fps"])
+    spi_bytes_per_second.set(smoothed_state["spi"])
+
+def record_stage(stage, seconds):
+    """Record the duration of a named stage (capture, display, classify, ...)."""
+    stage_seconds.labels(stage).observe(seconds)
+
+def record_classification(outcome, latency_seconds=None):
+    """Count a classification outcome: "success", "failure" or "timeout"."""
+    classifications.labels(outcome).inc()
+    if latency_seconds is not None:
+        classification_latency_seconds.observe(latency_seconds)
+
+def record_idle(stage, stage_name, changed, cpu_percent, wakeups_per_second):
+    """Publish the idle stage and the measured CPU usage and loop wakeups."""
+    idle_stage.set(stage)
+    idle_cpu_percent.set(cpu_percent)
+    loop_wakeups_per_second.set(wakeups_per_second)
+    if changed:
+        idle_transitions.labels(stage_name).inc()
+
+# -----------------------------------------------------------------------------
+# Raspberry Pi Health (only evaluated when the endpoint is scraped)
+# -----------------------------------------------------------------------------
+def read_cpu_temperature():
+    """CPU temperature in degrees Celsius, or None if it cannot be read."""
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp") as temperature_file:
+            return int(temperature_file.read()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+throttle_cache = {"time": 0.0, "value": None}
+
+def read_throttled_state():
+    """The bit field reported by "vcgencmd get_throttled", or None if unavailable."""
+    now = time.monotonic()
+    if now - throttle_cache["time"] < THROTTLE_CACHE_SECONDS:
+        return throttle_cache["value"]
+    try:
+        output = subprocess.run(["vcgencmd", "get_throttled"], capture_output=True,
+                                text=True, timeout=2).stdout
+        # Output looks like "throttled=0x50000"
+        value = int(output.strip().split("=")[1], 16)
+    except (OSError, IndexError, ValueError, subprocess.SubprocessError):
+        value = None
+    throttle_cache["time"] = now
+    throttle_cache["value"] = value
+    return value
+
+class PiHealthCollector:
+    """Reads temperature and throttling state when Prometheus scrapes, never on the hot path."""
+
+    def collect(self):
+        temperature = read_cpu_temperature()
+        if temperature is not None:
+            yield GaugeMetricFamily("cpu_temperature_celsius", "CPU temperature", value=temperature)
+
+        throttled = read_throttled_state()
+        if throttled is not None:
+            family = GaugeMetricFamily("pi_throttle_state", "Active vcgencmd get_throttled flags",
+                                       labels=["flag"])
+            for bit, flag in THROTTLE_FLAGS.items():
+                family.add_metric([flag], (throttled >> bit) & 1)
+            yield family
+
+REGISTRY.register(PiHealthCollector())
+
+class InferenceRouterCollector:
+    """Per-host state of the inference router, read when Prometheus scrapes."""
+
+    def __init__(self, router):
+        self.router = router
+
+    def collect(self):
+        report = self.router.report()
+        up = GaugeMetricFamily("inference_host_up", "Inference host passed its last health check", labels=["host"])
+        latency = GaugeMetricFamily("inference_host_latency_seconds", "Smoothed request time per inference host",
+                                    labels=["host"])
+        in_flight = GaugeMetricFamily("inference_host_in_flight", "Requests running on each inference host",
+                                      labels=["host"])
+        requests = CounterMetricFamily("inference_host_requests", "Requests sent to each inference host by outcome",
+                                       labels=["host", "outcome"])
+        for host, endpoint in report["endpoints"].items():
+            up.add_metric([host], int(endpoint["healthy"]))
+            if endpoint["latency_ewma_ms"] is not None:
+                latency.add_metric([host], endpoint["latency_ewma_ms"] / 1000)
+            in_flight.add_metric([host], endpoint["in_flight"])
+            for outcome in ("wins", "failures", "cancelled"):
+                requests.add_metric([host, outcome], endpoint[outcome])
+        yield up
+        yield latency
+        yield in_flight
+        yield requests
+        yield CounterMetricFamily("inference_hedges", "Requests also sent to a second host", value=report["hedges"])
+
+def watch_inference_router(router):
+    """Export the router's per-host health, latency and in-flight counts."""
+    REGISTRY.register(InferenceRouterCollector(router))
+
+# -----------------------------------------------------------------------------
+# Endpoint
+# -----------------------------------------------------------------------------
+def snapshot():
+    """All metrics in the Prometheus text format, e.g. to store next to a profile."""
+    return generate_latest(REGISTRY).decode("utf-8")
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics from a daemon thread, separate from the preview loop."""
+    start_http_server(port)
+    print(f"Metrics available on port {port} at /metrics")
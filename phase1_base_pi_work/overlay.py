@@ -0,0 +1,215 @@
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+SCREEN_WIDTH = 320
+SCREEN_HEIGHT = 240
+
+# Colours of the result badge, matching the LEDs.
+CATEGORY_COLOURS = {
+    1: (200, 30, 30),    # Rubbish (Red)
+    2: (230, 190, 0),    # Recyclable (Yellow)
+    3: (30, 160, 50),    # Organics (Green)
+    4: (30, 80, 210),    # Ecowaste (Blue)
+}
+
+BANNER_HEIGHT = 44
+BANNER_ALPHA = 170
+BADGE_HEIGHT = 56
+SPINNER_SIZE = 40
+SPINNER_FRAMES = 12
+SPINNER_FRAME_SECONDS = 0.08
+
+# -----------------------------------------------------------------------------
+# Pre-rendered Overlays
+# -----------------------------------------------------------------------------
+class Overlay:
+    """
+    A pre-rendered RGBA image placed at (x, y) on the preview.
+
+    The colour is stored premultiplied by alpha together with the inverse
+    alpha, both as uint16, so blending a frame only needs one multiply and one
+    add per channel. An overlay may have several frames (e.g. a spinner), the
+    current frame is picked from the clock.
+    """
+
+    def __init__(self, images, x, y, frame_seconds=None):
+        if isinstance(images, Image.Image):
+            images = [images]
+        self.x = x
+        self.y = y
+        self.width, self.height = images[0].size
+        self.frame_seconds = frame_seconds
+        self.frames = []
+        for image in images:
+            rgba = np.asarray(image.convert("RGBA"), dtype=np.uint16)
+            alpha = rgba[:, :, 3:4]
+            self.frames.append((rgba[:, :, :3] * alpha, 255 - alpha))
+
+    def current_frame(self, now):
+        if len(self.frames) == 1:
+            return self.frames[0]
+        return self.frames[int(now / self.frame_seconds) % len(self.frames)]
+
+    def blend_onto(self, frame, now):
+        """Alpha blend onto an RGB uint8 frame in place, touching only this rectangle."""
+        premultiplied, inverse_alpha = self.current_frame(now)
+        # Clip to the frame in case the overlay sits partly off screen.
+        height = min(self.height, frame.shape[0] - self.y)
+        width = min(self.width, frame.shape[1] - self.x)
+        if height <= 0 or width <= 0:
+            return
+        region = frame[self.y:self.y + height, self.x:self.x + width]
+        blended = region * inverse_alpha[:height, :width] + premultiplied[:height, :width]
+        # Exact division by 255 for values up to 65535 without a slow integer divide.
+        region[:] = (blended + 1 + (blended >> 8)) >> 8
+
+@lru_cache(maxsize=8)
+def load_font(size):
+    """Load a TrueType font with the same fallbacks as the full-screen messages."""
+    for name in ("arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except IOError:
+            pass
+    return ImageFont.load_default()
+
+def fit_font(draw, text, max_width, sizes=(24, 20, 16, 12)):
+    """Pick the largest font size at which the text fits the given width."""
+    for size in sizes:
+        font = load_font(size)
+        bbox = draw.textbbox((0, 0), text, font=font)
+        if bbox[2] - bbox[0] <= max_width:
+            return font, bbox
+    return font, bbox
+
+@lru_cache(maxsize=32)
+def render_banner(message):
+    """Semi-transparent status banner across the top of the screen."""
+    image = Image.new("RGBA", (SCREEN_WIDTH, BANNER_HEIGHT), (0, 0, 0, BANNER_ALPHA))
+    draw = ImageDraw.Draw(image)
+    font, bbox = fit_font(draw, message, SCREEN_WIDTH - 12)
+    x_pos = (SCREEN_WIDTH - (bbox[2] - bbox[0])) // 2 - bbox[0]
+    y_pos = (BANNER_HEIGHT - (bbox[3] - bbox[1])) // 2 - bbox[1]
+    draw.text((x_pos, y_pos), message, fill="white", font=font)
+    return Overlay(image, 0, 0)
+
+@lru_cache(maxsize=32)
+def render_result_badge(waste_type, result_name, waste_name=None):
+    """Result badge in the category colour along the bottom of the screen."""
+    colour = CATEGORY_COLOURS.get(waste_type, (90, 90, 90))
+    image = Image.new("RGBA", (SCREEN_WIDTH - 16, BADGE_HEIGHT), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle((0, 0, image.width - 1, image.height - 1), radius=12, fill=colour + (220,))
+    label = f"{result_name}: {waste_name}" if waste_name else result_name
+    font, bbox = fit_font(draw, label, image.width - 16, sizes=(28, 24, 20, 16, 12))
+    x_pos = (image.width - (bbox[2] - bbox[0])) // 2 - bbox[0]
+    y_pos = (image.height - (bbox[3] - bbox[1])) // 2 - bbox[1]
+    draw.text((x_pos, y_pos), label, fill="white", font=font)
+    return Overlay(image, 8, SCREEN_HEIGHT - BADGE_HEIGHT - 8)
+
+@lru_cache(maxsize=1)
+def render_spinner():
+    """Rotating progress arc in the centre of the screen, all frames rendered once."""
+    images = []
+    for index in range(SPINNER_FRAMES):
+        image = Image.new("RGBA", (SPINNER_SIZE, SPINNER_SIZE), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        start = index * 360 / SPINNER_FRAMES
+        draw.ellipse((2, 2, SPINNER_SIZE - 3, SPINNER_SIZE - 3), outline=(255, 255, 255, 80), width=5)
+        draw.arc((2, 2, SPINNER_SIZE - 3, SPINNER_SIZE - 3), start, start + 90, fill=(255, 255, 255, 255), width=5)
+        images.append(image)
+    return Overlay(images, (SCREEN_WIDTH - SPINNER_SIZE) // 2, (SCREEN_HEIGHT - SPINNER_SIZE) // 2,
+                   frame_seconds=SPINNER_FRAME_SECONDS)
+
+# -----------------------------------------------------------------------------
+# Compositor
+# -----------------------------------------------------------------------------
+class OverlayCompositor:
+    """
+    Keeps the named overlay layers (status, result, spinner, ...) and draws them
+    over each preview frame.
+
+    Layers are set from the button callbacks and read by the preview thread.
+    Every change replaces the whole layer dict, so the preview thread always
+    sees a consistent snapshot without taking a lock. Changes (including
+    dropping expired layers) are made under a lock, so a layer set from one
+    thread is never lost to a copy made by another.
+    """
+
+    # Drawing order, bottom to top.
+    LAYER_ORDER = ("result", "spinner", "status")
+
+    def __init__(self):
+        self.layers = {}
+        self.lock = threading.Lock()
+        self.last_cost_seconds = 0.0
+        self.average_cost_seconds = 0.0
+
+    def set_layer(self, name, overlay, duration=None):
+        """Show an overlay on a layer, optionally only for `duration` seconds."""
+        expires = time.monotonic() + duration if duration else None
+        with self.lock:
+            layers = dict(self.layers)
+            layers[name] = (overlay, expires)
+            self.layers = layers
+
+    def clear_layer(self, name):
+        with self.lock:
+            if name in self.layers:
+                layers = dict(self.layers)
+                del layers[name]
+                self.layers = layers
+
+    def clear(self):
+        with self.lock:
+            self.layers = {}
+
+    def composite(self, frame):
+        """Blend all active layers onto an RGB uint8 frame in place and return it."""
+        layers = self.layers
+        if not layers:
+            self.last_cost_seconds = 0.0
+            return frame
+
+        start = time.perf_counter()
+        now = time.monotonic()
+        expired = False
+        for name in self.LAYER_ORDER:
+            entry = layers.get(name)
+            if entry is None:
+                continue
+            overlay, expires = entry
+            if expires is not None and now >= expires:
+                expired = True
+                continue
+            overlay.blend_onto(frame, now)
+        if expired:
+            with self.lock:
+                self.layers = {name: entry for name, entry in self.layers.items()
+                               if entry[1] is None or entry[1] > now}
+
+        self.last_cost_seconds = time.perf_counter() - start
+        self.average_cost_seconds += 0.05 * (self.last_cost_seconds - self.average_cost_seconds)
+        return frame
+
+def benchmark(frames=500):
+    """Print the compositing cost per frame with a banner, spinner and result badge."""
+    compositor = OverlayCompositor()
+    compositor.set_layer("status", render_banner("Classifying waste..."))
+    compositor.set_layer("spinner", render_spinner())
+    compositor.set_layer("result", render_result_badge(2, "Recyclable", "Egg container"))
+    frame = np.random.randint(0, 256, (SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    for _ in range(frames):
+        compositor.composite(frame)
+    elapsed = time.perf_counter() - start
+    print(f"Composited {frames} frames, {elapsed / frames * 1000:.2f} ms per frame.")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Target time from capture button press to result on the LCD.
+LATENCY_BUDGET_MS = 4000
+
+# Capture resolutions to choose from, best first.
+CAPTURE_SIZES = [(1640, 1232), (1280, 960), (1024, 768), (800, 600), (640, 480)]
+# Fraction of the frame kept around the centre, where the item is held.
+CROP_FRACTIONS = [1.0, 0.75]
+JPEG_QUALITIES = [90, 80, 70, 60]
+
+# Quality floor, never go below this however bad the link is.
+MIN_CAPTURE_PIXELS = 640 * 480
+MIN_JPEG_QUALITY = 60
+
+# Smoothing factor for all the moving averages.
+EWMA_ALPHA = 0.3
+
+# Starting guesses until the first classifications have been measured.
+INITIAL_THROUGHPUT_BYTES_PER_SECOND = 1_000_000
+INITIAL_INFERENCE_MS = 1500
+# Local time covers the settle delay, capture, encoding and archiving.
+INITIAL_LOCAL_MS = 300
+# Typical JPEG sizes for camera photos, in bytes per pixel.
+INITIAL_BYTES_PER_PIXEL = {90: 0.25, 80: 0.16, 70: 0.12, 60: 0.10}
+# The image is sent base64 encoded inside JSON.
+BASE64_OVERHEAD = 4 / 3
+
+# Every decision and its outcome is appended here for auditing.
+DECISION_LOG = "quality_decisions.jsonl"
+
+def ewma(previous, value, alpha=EWMA_ALPHA):
+    return value if previous is None else previous + alpha * (value - previous)
+
+# -----------------------------------------------------------------------------
+# Adaptive Quality Controller
+# -----------------------------------------------------------------------------
+class QualityController:
+    """
+    Picks the capture resolution, centre crop and JPEG quality for each
+    classification so the button-to-result latency stays within the budget.
+
+    The prediction for an option is local time (settle delay, capture,
+    encoding and archiving before the request is sent) + upload time
+    (estimated bytes / measured throughput) + server inference time. Throughput,
+    inference time per resolution, local time and JPEG bytes per pixel are all
+    tracked as EWMAs of the recent classifications. The best option that fits
+    the budget is used, and never anything below the quality floor.
+    """
+
+    def __init__(self, budget_ms=LATENCY_BUDGET_MS, log_path=DECISION_LOG):
+        self.budget_ms = budget_ms
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.throughput = INITIAL_THROUGHPUT_BYTES_PER_SECOND
+        self.local_ms = INITIAL_LOCAL_MS
+        self.inference_ms = None
+        self.inference_ms_by_size = {}
+        self.bytes_per_pixel = dict(INITIAL_BYTES_PER_PIXEL)
+
+        # All options above the floor, from best to cheapest.
+        self.options = []
+        for size in CAPTURE_SIZES:
+            for crop in CROP_FRACTIONS:
+                for quality in JPEG_QUALITIES:
+                    pixels = int(size[0] * crop) * int(size[1] * crop)
+                    if pixels >= MIN_CAPTURE_PIXELS and quality >= MIN_JPEG_QUALITY:
+                        self.options.append({"size": size, "crop": crop, "quality": quality, "pixels": pixels})
+
+    def predict_ms(self, option):
+        """Predicted button-to-result time for a capture option."""
+        upload_bytes = option["pixels"] * self.bytes_per_pixel[option["quality"]] * BASE64_OVERHEAD
+        upload_ms = upload_bytes / self.throughput * 1000
+        inference_ms = self.inference_ms_by_size.get(option["size"], self.inference_ms or INITIAL_INFERENCE_MS)
+        return self.local_ms + upload_ms + inference_ms
+
+    def choose(self):
+        """Return the capture decision for the next classification."""
+        with self.lock:
+            chosen = self.options[-1]
+            predicted = self.predict_ms(chosen)
+            for option in self.options:
+                option_ms = self.predict_ms(option)
+                if option_ms <= self.budget_ms:
+                    chosen, predicted = option, option_ms
+                    break
+            return {
+                "time": time.time(),
+                "size": chosen["size"],
+                "crop": chosen["crop"],
+                "quality": chosen["quality"],
+                "pixels": chosen["pixels"],
+                "predicted_ms": predicted,
+                "throughput": self.throughput,
+                "fits_budget": predicted <= self.budget_ms,
+            }
+
+    def fixed_decision(self, size, quality, crop=1.0):
+        """
+        A decision for an image whose size and quality were not chosen here
+        (e.g. a preview frame from the classification worker), so its timings
+        can still be passed to record().
+        """
+        pixels = int(size[0] * crop) * int(size[1] * crop)
+        option = {"size": size, "crop": crop, "quality": quality, "pixels": pixels}
+        with self.lock:
+            predicted = self.predict_ms(option)
+            return dict(option, time=time.time(), predicted_ms=predicted, throughput=self.throughput,
+                        fits_budget=predicted <= self.budget_ms)
+
+    def record(self, decision, jpeg_bytes, local_ms, upload_bytes, total_ms, server_ms, category=None,
+               latency_ms=None):
+        """
+        Update the averages with a finished classification and log the decision
+        next to what actually happened. local_ms is everything from the button
+        press until the request was sent, latency_ms the measured button to
+        result time the budget applies to.
+        """
+        with self.lock:
+            self.local_ms = ewma(self.local_ms, local_ms)
+            quality = decision["quality"]
+            self.bytes_per_pixel[quality] = ewma(self.bytes_per_pixel[quality], jpeg_bytes / decision["pixels"])
+            if server_ms is not None:
+                self.inference_ms = ewma(self.inference_ms, server_ms)
+                size = decision["size"]
+                self.inference_ms_by_size[size] = ewma(self.inference_ms_by_size.get(size), server_ms)
+                # What is left of the request time is mostly the upload.
+                transfer_seconds = max(total_ms - server_ms, 1) / 1000
+                self.throughput = ewma(self.throughput, upload_bytes / transfer_seconds)
+
+        actual_ms = latency_ms if latency_ms is not None else local_ms + total_ms
+        entry = dict(decision, jpeg_bytes=jpeg_bytes, local_ms=local_ms, upload_bytes=upload_bytes,
+                     request_ms=total_ms, server_ms=server_ms, actual_ms=actual_ms,
+                     within_budget=actual_ms <= self.budget_ms, category=category)
+        entry["size"] = list(entry["size"])
+        print(f"Capture {decision['size'][0]}x{decision['size'][1]} crop {decision['crop']} q{quality}: "
+              f"predicted {decision['predicted_ms']:.0f} ms, actual {actual_ms:.0f} ms")
+        try:
+            with open(self.log_path, "a") as log_file:
+                log_file.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"Could not write quality decision log: {e}")
@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# How long a profile runs once triggered.
+PROFILE_SECONDS = 10
+
+# Time between two samples of all thread stacks (200 per second).
+SAMPLE_INTERVAL = 0.005
+
+# Profiles and their metrics snapshots are written here.
+PROFILE_DIR = "profiles"
+
+# -----------------------------------------------------------------------------
+# Sampling Profiler
+# -----------------------------------------------------------------------------
+class SamplingProfiler:
+    """
+    Samples the Python stacks of all threads (preview loop, LED blinker,
+    gpiozero callbacks, ...) from a background thread for a fixed window.
+
+    Nothing is instrumented, so the running program is only slowed down by the
+    sampling itself, which is measured and reported. The result is written in
+    the collapsed stack format ("thread;outer;...;inner count" per line), which
+    flamegraph.pl and speedscope.app turn into a flame graph. The snapshot
+    callable (e.g. metrics.snapshot) is saved before and after the window, so
+    the stage latency counters can be compared for the same period.
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR, duration=PROFILE_SECONDS,
+                 interval=SAMPLE_INTERVAL, snapshot=None):
+        self.output_dir = output_dir
+        self.duration = duration
+        self.interval = interval
+        self.snapshot = snapshot
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Frame labels per code object, so formatting is done once per function.
+        self.labels = {}
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Start a profile. Returns False if one is already running."""
+        with self.lock:
+            if self.running():
+                return False
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """End the running profile early, it is still written."""
+        self.stop_event.set()
+
+    def toggle(self):
+        """Start a profile, or end the running one. Returns True if a profile was started."""
+        if self.start():
+            return True
+        self.stop()
+        return False
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            # Semicolons separate the frames in the collapsed format.
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self.labels[code] = label
+        return label
+
+    def _run(self):
+        started = time.strftime("%Y%m%d-%H%M%S")
+        before = self._take_snapshot()
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        sampling_seconds = 0.0
+        thread_names = {}
+
+        start = time.perf_counter()
+        deadline = start + self.duration
+        next_sample = start
+        while not self.stop_event.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_sample:
+                self.stop_event.wait(next_sample - now)
+                continue
+            next_sample += self.interval
+
+            frames = sys._current_frames()
+            if len(thread_names) != len(frames):
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(thread_names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            sampling_seconds += time.perf_counter() - now
+        elapsed = time.perf_counter() - start
+
+        after = self._take_snapshot()
+        self._write(started, stacks, samples, elapsed, sampling_seconds, before, after)
+
+    def _take_snapshot(self):
+        if self.snapshot is None:
+            return ""
+        try:
+            return self.snapshot()
+        except Exception as e:
+            return f"# snapshot failed: {e}\n"
+
+    def _write(self, started, stacks, samples, elapsed, sampling_seconds, before, after):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            base = os.path.join(self.output_dir, f"profile-{started}")
+            with open(base + ".collapsed", "w") as profile_file:
+                for stack, count in stacks.most_common():
+                    profile_file.write(f"{stack} {count}\n")
+            with open(base + "-metrics.txt", "w") as metrics_file:
+                metrics_file.write(f"# {samples} samples in {elapsed:.1f} s, "
+                                   f"sampling took {sampling_seconds / max(elapsed, 1e-9):.1%} of the time\n")
+                metrics_file.write("# ---- before ----\n")
+                metrics_file.write(before)
+                metrics_file.write("# ---- after ----\n")
+                metrics_file.write(after)
+        except OSError as e:
+            print(f"Could not write profile: {e}")
+            return
+        print(f"Profile written to {base}.collapsed ({samples} samples in {elapsed:.1f} s, "
+              f"sampling overhead {sampling_seconds / max(elapsed, 1e-9):.1%})")
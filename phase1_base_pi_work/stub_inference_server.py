@@ -0,0 +1,144 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Answers the stub picks from, like llm_processor.py would send them.
+STUB_RESULTS = [
+    {"waste_category": "Rubbish", "waste_name": "Soft plastic", "waste_type": 1},
+    {"waste_category": "Recyclable", "waste_name": "Egg container", "waste_type": 2},
+    {"waste_category": "Organics", "waste_name": "Banana peel", "waste_type": 3},
+    {"waste_category": "EcoWaste", "waste_name": "Battery waste", "waste_type": 4},
+]
+
+# -----------------------------------------------------------------------------
+# Stub Server
+# -----------------------------------------------------------------------------
+class StubState:
+    """
+    The behaviour of one stub server. It can be changed while running with
+    POST /control, e.g. {"latency": 8.0} to make it busy or
+    {"healthy": false} to make it look like it is rebooting.
+    """
+
+    def __init__(self, latency, jitter=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.healthy = True
+        self.lock = threading.Lock()
+        self.active = 0
+        self.served = 0
+        self.cancelled = 0
+
+    def update(self, changes):
+        with self.lock:
+            for key in ("latency", "jitter", "failure_rate", "healthy"):
+                if key in changes:
+                    setattr(self, key, changes[key])
+
+    def report(self):
+        with self.lock:
+            return {"latency": self.latency, "jitter": self.jitter, "failure_rate": self.failure_rate,
+                    "healthy": self.healthy, "active": self.active, "served": self.served,
+                    "cancelled": self.cancelled}
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        """Speaks the same /classify and /health API as llm_processor.py."""
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                report = state.report()
+                if report["healthy"]:
+                    self.send_json(200, {"status": "ok", "model": "stub", "active_requests": report["active"]})
+                else:
+                    self.send_json(503, {"status": "starting"})
+            elif self.path == "/stats":
+                self.send_json(200, state.report())
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if self.path == "/control":
+                state.update(json.loads(body or b"{}"))
+                self.send_json(200, state.report())
+                return
+            if self.path != "/classify":
+                self.send_json(404, {"error": "not found"})
+                return
+            if not state.healthy:
+                # A machine that is down does not answer at all.
+                self.close_connection = True
+                return
+
+            with state.lock:
+                state.active += 1
+                delay = max(state.latency + random.uniform(-state.jitter, state.jitter), 0)
+                fail = random.random() < state.failure_rate
+            try:
+                time.sleep(delay)
+                if fail:
+                    self.send_json(502, {"error": "stub failure"})
+                    return
+                result = dict(random.choice(STUB_RESULTS), stats={"total_ms": delay * 1000})
+                self.send_json(200, result)
+                with state.lock:
+                    state.served += 1
+            except OSError:
+                # The client hung up, e.g. a hedged request that lost.
+                with state.lock:
+                    state.cancelled += 1
+            finally:
+                with state.lock:
+                    state.active -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+def start_stub(port, latency, jitter=0.0, failure_rate=0.0, host="127.0.0.1"):
+    """Start a stub server in a daemon thread. Returns (server, state)."""
+    state = StubState(latency, jitter, failure_rate)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stub inference servers with injectable latency, for testing the inference router.")
+    parser.add_argument("servers", nargs="+", metavar="PORT:LATENCY[:JITTER[:FAILURE_RATE]]",
+                        help="e.g. 5001:0.8 5002:2.5:0.5 5003:8:1:0.1 (seconds, failure rate 0-1)")
+    args = parser.parse_args()
+
+    for spec in args.servers:
+        port, latency, *rest = spec.split(":")
+        jitter = float(rest[0]) if rest else 0.0
+        failure_rate = float(rest[1]) if len(rest) > 1 else 0.0
+        start_stub(int(port), float(latency), jitter, failure_rate)
+        print(f"Stub inference server on http://127.0.0.1:{port}/classify "
+              f"({latency} s +/- {jitter} s, {failure_rate:.0%} failures)")
+    print("Change a server while running with e.g.")
+    print("  curl -d '{\"latency\": 8}' http://127.0.0.1:<port>/control")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStub servers stopped.")
@@ -1,14 +1,14 @@
+import io
+import signal
 import time
 import numpy as np
 from picamera2 import Picamera2
 from luma.core.interface.serial import spi
 from luma.lcd.device import st7789
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 from threading import Thread
-from gpiozero import Button, OutputDevice, LED
+from gpiozero import Button, PWMOutputDevice, LED
 from signal import pause
-import random
-import textwrap
 
 # Luma.core.render is needed for the canvas function
 from luma.core.render import canvas
@@ -16,6 +16,20 @@ from luma.core.render import canvas
 from luma.core.legacy import text
 from luma.core.legacy.font import proportional, LCD_FONT
 
+from capture_archive import CaptureArchive
+import classification_worker as worker_config
+from classification_worker import ClassificationWorker
+from event_log import EventLog
+from inference_router import InferenceRouter
+from quality_controller import QualityController
+import sampling_profiler
+from sampling_profiler import SamplingProfiler
+from waste_client import simulate_api_call
+import metrics
+import overlay
+import idle_policy
+from idle_policy import IdlePolicy
+
 # -----------------------------------------------------------------------------
 # Global Variables and Configuration
 # -----------------------------------------------------------------------------
@@ -23,6 +37,14 @@ picam2 = None
 camera_running = False
 main_loop_thread = None
 led_thread = None
+classification_worker = None
+# True while a captured image is being classified. The preview keeps running
+# during classification, status and results are drawn over it.
+classifying = False
+# The start button acts on release. These remember whether the current press
+# became the profiler gesture, and whether it already woke the bin up.
+start_press_is_gesture = False
+start_press_woke_up = False
 
 # Define the physical GPIO pins for the buttons.
 # We are now using gpiozero, which simplifies button handling.
@@ -31,6 +53,36 @@ START_BUTTON_PIN = 16
 # Button 2 will be for capturing a photo.
 CAPTURE_BUTTON_PIN = 26
 
+# Size of the lores stream used to detect motion while the bin is idle.
+LORES_SIZE = (160, 120)
+
+# Captures are stored by content hash in this archive, together with the
+# classification result (see capture_archive.py).
+ARCHIVE_DIR = "capture_archive"
+
+# Addresses of llm_processor.py on the inference machines, e.g.
+# ["http://192.168.1.50:5000/classify", "http://192.168.1.51:5000/classify",
+#  "http://192.168.1.60:5000/classify"] for the GPU box, a second desktop and
+# a slow CPU fallback. Each request goes to the best one that is up (see
+# inference_router.py). Leave empty to simulate the call.
+INFERENCE_URLS = []
+
+# Run the JPEG encoding, archiving and classification in a separate process.
+# Frames are handed over through a shared-memory ring, so the preview loop does
+# not compete with that work for the GIL (see classification_worker.py).
+USE_CLASSIFICATION_WORKER = False
+
+# Holding the start button and then the capture button for this long (or
+# "kill -USR1 <pid>") records a sampling profile of all threads for
+# sampling_profiler.PROFILE_SECONDS, see sampling_profiler.py.
+PROFILE_HOLD_SECONDS = 3
+
+# Every press, capture, result and stage time is appended to a binary event
+# log here, for the daily statistics of "python event_log.py" (see
+# event_log.py). BIN_ID tells the bins apart when their logs are combined.
+EVENT_LOG_DIR = "event_log"
+BIN_ID = 0
+
 # LED pins
 RED_LED_PIN = 22
 YELLOW_LED_PIN = 27
@@ -48,28 +100,72 @@ BLUE_LED_PIN = 6
 # CS   -> GPIO8  (Chip Select)
 # BLK  -> GPIO23 (Backlight)
 
-# Control the backlight pin using a gpiozero OutputDevice.
-backlight = OutputDevice(23, active_high=True, initial_value=True)
+# The display, buttons, LEDs, archive and event log are only opened in main().
+# The classification worker is started with "spawn", which imports this
+# script again in the worker process, so nothing here may touch the hardware
+# at import time.
+backlight = None
+serial = None
+device = None
+
+def setup_display():
+    global backlight, serial, device
+    # Control the backlight pin using a gpiozero PWMOutputDevice, so it can be
+    # dimmed when the bin is idle.
+    backlight = PWMOutputDevice(23, active_high=True, initial_value=1.0)
 
-# Luma.LCD requires a serial interface object.
-serial = spi(port=0, device=0, gpio_DC=25, gpio_RST=24)
+    # Luma.LCD requires a serial interface object.
+    serial = spi(port=0, device=0, gpio_DC=25, gpio_RST=24)
 
-# Initialize the ST7789 device with the correct dimensions.
-device = st7789(serial, width=320, height=240, rotate=0, bgr=False)
+    # Initialize the ST7789 device with the correct dimensions.
+    device = st7789(serial, width=320, height=240, rotate=0, bgr=False)
 
 # -----------------------------------------------------------------------------
 # GPIO Button and LED Setup
 # -----------------------------------------------------------------------------
-# Set up the buttons. gpiozero handles pull-up/pull-down resistors
-# and event detection automatically.
-start_button = Button(START_BUTTON_PIN) # Assumes button is connected to GND
-capture_button = Button(CAPTURE_BUTTON_PIN)
-
-# Set up the LEDs
-red_led = LED(RED_LED_PIN)
-yellow_led = LED(YELLOW_LED_PIN)
-green_led = LED(GREEN_LED_PIN)
-blue_led = LED(BLUE_LED_PIN)
+start_button = None
+capture_button = None
+red_led = None
+yellow_led = None
+green_led = None
+blue_led = None
+
+def setup_buttons_and_leds():
+    global start_button, capture_button, red_led, yellow_led, green_led, blue_led
+    # Set up the buttons. gpiozero handles pull-up/pull-down resistors
+    # and event detection automatically.
+    start_button = Button(START_BUTTON_PIN) # Assumes button is connected to GND
+    capture_button = Button(CAPTURE_BUTTON_PIN)
+
+    # Set up the LEDs
+    red_led = LED(RED_LED_PIN)
+    yellow_led = LED(YELLOW_LED_PIN)
+    green_led = LED(GREEN_LED_PIN)
+    blue_led = LED(BLUE_LED_PIN)
+
+# Capture archive and its index, opened in main().
+archive = None
+
+# Records what happens at the bin for the daily statistics, opened in main().
+event_log = None
+
+# Draws the status banner, spinner and result badge over the live preview.
+compositor = overlay.OverlayCompositor()
+
+# Steps the preview down to save power when nobody uses the bin.
+idle = IdlePolicy()
+
+# Picks the capture resolution and JPEG quality from the measured link speed
+# and inference time (only used when INFERENCE_URLS is set).
+quality_controller = QualityController()
+
+# Records a flame graph of all threads on demand, with the stage metrics of
+# the same window.
+profiler = SamplingProfiler(snapshot=metrics.snapshot)
+
+# Health checks the inference machines and routes each request to the best one.
+# With the classification worker the router runs in the worker process instead.
+inference_router = None
 
 # -----------------------------------------------------------------------------
 # Helper Functions
@@ -81,82 +177,31 @@ def turn_off_all_leds():
     green_led.off()
     blue_led.off()
 
-def display_centered_message(message, duration=3):
-    """Display a centered message on the screen with bigger text that can span multiple lines"""
-    # Create a blank image to draw the message on
-    message_image = Image.new('RGB', (device.width, device.height), "black")
-    draw = ImageDraw.Draw(message_image)
-
-    # Load a larger font for drawing the text
-    try:
-        # Try to use a system font with larger size
-        font = ImageFont.truetype("arial.ttf", 32)
-    except IOError:
-        try:
-            # Try alternative font names
-            font = ImageFont.truetype("DejaVuSans.ttf", 32)
-        except IOError:
-            try:
-                # Try another common font
-                font = ImageFont.truetype("LiberationSans-Regular.ttf", 32)
-            except IOError:
-                # Fall back to default font (will be smaller)
-                font = ImageFont.load_default()
-
-    # Wrap text to fit the screen width
-    # Estimate characters per line based on screen width and font size
-    chars_per_line = device.width // 16  # Rough estimate for 32pt font
-    wrapped_lines = textwrap.wrap(message, width=chars_per_line)
-    
-    # If wrapping results in too many lines, try with smaller font
-    if len(wrapped_lines) > 6:  # Too many lines for screen
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-        except IOError:
-            try:
-                font = ImageFont.truetype("DejaVuSans.ttf", 24)
-            except IOError:
-                font = ImageFont.load_default()
-        
-        chars_per_line = device.width // 12  # Adjust for smaller font
-        wrapped_lines = textwrap.wrap(message, width=chars_per_line)
-
-    # Calculate total text height
-    line_height = 0
-    for line in wrapped_lines:
-        text_bbox = draw.textbbox((0, 0), line, font=font)
-        line_height = max(line_height, text_bbox[3] - text_bbox[1])
-    
-    total_text_height = len(wrapped_lines) * line_height
-    
-    # Calculate starting Y position to center all lines vertically
-    start_y = (device.height - total_text_height) // 2
-    
-    # Draw each line centered horizontally
-    current_y = start_y
-    for line in wrapped_lines:
-        # Get the dimensions of the current line
-        text_bbox = draw.textbbox((0, 0), line, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        
-        # Calculate the position to draw the text for horizontal centering
-        x_pos = (device.width - text_width) // 2
-        
-        # Draw the text on the image
-        draw.text((x_pos, current_y), line, fill="white", font=font)
-        
-        # Move to next line
-        current_y += line_height
-    
-    # Display the message on the screen
-    device.display(message_image)
-    
-    # Pause for the specified duration
-    time.sleep(duration)
-
 # -----------------------------------------------------------------------------
 # Core Functions
 # -----------------------------------------------------------------------------
+# Sensor frame duration limits in microseconds. When dimmed the sensor is
+# slowed down to 4 fps, which is enough for the once a second motion check.
+ACTIVE_FRAME_DURATION_LIMITS = (100, 83333)
+DIMMED_FRAME_DURATION_LIMITS = (250000, 250000)
+
+def apply_idle_stage(stage, previous_stage):
+    """Set the backlight and camera state for a new idle stage."""
+    print(f"Idle stage: {idle_policy.STAGE_NAMES[previous_stage]} -> {idle_policy.STAGE_NAMES[stage]}")
+    backlight.value = idle_policy.BACKLIGHT_LEVEL[stage]
+    if previous_stage == idle_policy.DEEP:
+        picam2.start()
+    if stage == idle_policy.DEEP:
+        picam2.stop()
+    elif stage == idle_policy.DIMMED:
+        picam2.set_controls({"FrameDurationLimits": DIMMED_FRAME_DURATION_LIMITS})
+    elif previous_stage >= idle_policy.DIMMED:
+        picam2.set_controls({"FrameDurationLimits": ACTIVE_FRAME_DURATION_LIMITS})
+
+def lores_luma():
+    """Luminance plane of the small lores stream (YUV420), used for motion checks."""
+    return picam2.capture_array("lores")[:LORES_SIZE[1], :LORES_SIZE[0]]
+
 def camera_feed_loop():
     """
     Function to run in a separate thread for the camera feed.
@@ -167,8 +212,10 @@ def camera_feed_loop():
         # Initialize the Picamera2 object.
         picam2 = Picamera2()
 
-        # Configure the camera to capture a 320x240 image.
-        camera_config = picam2.create_preview_configuration(main={"size": (320, 240), "format": "XRGB8888"})
+        # Configure the camera to capture a 320x240 image, plus a small
+        # lores stream for the motion checks while idle.
+        camera_config = picam2.create_preview_configuration(main={"size": (320, 240), "format": "XRGB8888"},
+                                                            lores={"size": LORES_SIZE})
         picam2.configure(camera_config)
 
         # Start the camera stream.
@@ -177,15 +224,74 @@ def camera_feed_loop():
         print("Camera feed started.")
         camera_running = True
 
+        last_frame_time = None
+        stage = idle_policy.ACTIVE
+        idle.reset()
         while camera_running:
-            # Capture a frame as a Pillow Image.
-            frame_image = picam2.capture_image()
+            # Work out the idle stage, the bin stays active while classifying.
+            previous_stage = stage
+            stage = idle.update(hold=classifying)
+            if stage != previous_stage:
+                apply_idle_stage(stage, previous_stage)
+                last_frame_time = None
+            metrics.record_idle(stage, idle_policy.STAGE_NAMES[stage], stage != previous_stage,
+                                idle.cpu_percent, idle.wakeups_per_second)
+            
+            if stage == idle_policy.DEEP:
+                # Camera is stopped, sleep until a button press wakes us up.
+                idle.wait()
+                continue
+            
+            if stage != idle_policy.ACTIVE and idle.motion_detected(lores_luma()):
+                idle.activity("motion")
+                continue
+            
+            if stage == idle_policy.DIMMED:
+                # No frames to the LCD, only the motion check once a second.
+                idle.wait()
+                continue
+            
+            frame_start = time.perf_counter()
+            
+            # Capture a frame as a numpy array. XRGB8888 arrives as B, G, R, X
+            # so the channels are flipped into an RGB array we can draw on.
+            raw = picam2.capture_array()[:, :, 2::-1]
+            if classification_worker:
+                # Flip straight into the worker's ring slot, so the raw frame
+                # (without overlays) is handed over without an extra copy.
+                seq, frame = classification_worker.slot_for_writing()
+                np.copyto(frame, raw)
+                classification_worker.publish(seq)
+                # The overlays are drawn on a copy, the slot stays raw.
+                if compositor.layers:
+                    frame = frame.copy()
+            else:
+                frame = np.ascontiguousarray(raw)
+            capture_done = time.perf_counter()
+            
+            # Draw the active overlays (status, spinner, result) onto the frame.
+            compositor.composite(frame)
+            composite_done = time.perf_counter()
             
             # Display the image on the LCD.
-            device.display(frame_image)
+            device.display(Image.fromarray(frame))
+            display_done = time.perf_counter()
             
-            # A short delay to control the frame rate.
-            time.sleep(0.05)
+            # The first frame after waking up ends the resume measurement.
+            resume_seconds = idle.frame_shown()
+            if resume_seconds is not None:
+                metrics.resume_latency_seconds.observe(resume_seconds)
+            
+            # Record the frame for the metrics endpoint.
+            metrics.record_stage("preview_capture", capture_done - frame_start)
+            metrics.record_stage("overlay_composite", composite_done - capture_done)
+            metrics.record_stage("preview_display", display_done - composite_done)
+            if last_frame_time is not None:
+                metrics.record_preview_frame(frame_start - last_frame_time, device.width, device.height)
+            last_frame_time = frame_start
+            
+            # A short delay to control the frame rate (longer when idle).
+            idle.wait()
     except RuntimeError as e:
         print(f"Error: {e}. Check your camera connection and configuration.")
         # Stop the loop and reset camera_running state
@@ -193,6 +299,7 @@ def camera_feed_loop():
     except Exception as e:
         print(f"Camera loop error: {e}")
     finally:
+        backlight.value = 1.0
         if picam2:
             picam2.stop()
             # Explicitly close the camera resource to ensure it's fully released.
@@ -200,21 +307,62 @@ def camera_feed_loop():
             print("Camera feed stopped and resource closed.")
         picam2 = None
 
-def start_camera_on_press():
+def toggle_profiler(reason):
+    if profiler.toggle():
+        print(f"Profiling all threads for {sampling_profiler.PROFILE_SECONDS} s ({reason}).")
+        compositor.set_layer("status", overlay.render_banner("Profiling..."),
+                             duration=sampling_profiler.PROFILE_SECONDS)
+    else:
+        print(f"Profiling stopped early ({reason}).")
+
+def on_profiler_signal(signum, frame):
+    toggle_profiler("SIGUSR1")
+
+def on_button_held():
+    global start_press_is_gesture
+    # A start button held this long is never a normal press.
+    if start_button.is_held:
+        start_press_is_gesture = True
+    # Both buttons report being held, only the second one sees both held.
+    if start_button.is_held and capture_button.is_held:
+        toggle_profiler("both buttons held")
+
+def start_button_pressed():
+    """
+    The start button acts when it is released, so a press that turns into the
+    profiler gesture can be told apart without waiting. Only the wake-up
+    happens right away, so the preview resumes while the button is still down.
+    """
+    global start_press_is_gesture, start_press_woke_up
+    start_press_is_gesture = False
+    start_press_woke_up = camera_running and idle.activity("start button") in idle_policy.WAKE_UP_STAGES
+
+def start_camera_on_release():
     """
-    Callback function to start the camera feed when the button is pressed.
-    This function is triggered by the gpiozero event.
+    Callback function to start or stop the camera feed when the button is
+    released. This function is triggered by the gpiozero event.
     """
     global main_loop_thread, camera_running
 
-    if not camera_running or camera_running == "processing":
+    # Part of the profiler gesture, or held too long for a normal press.
+    if start_press_is_gesture or start_button.is_held:
+        return
+    event_log.press("start")
+
+    # A press while the screen is dimmed or off only wakes the bin up.
+    if start_press_woke_up:
+        print(f"Start button pressed on GPIO {START_BUTTON_PIN}. Waking up from idle.")
+        return
+
+    if not camera_running:
         print(f"Start button pressed on GPIO {START_BUTTON_PIN}. Starting camera feed...")
         
         # Turn off all LEDs immediately when starting camera
         turn_off_all_leds()
         
-        # Display startup message for 3 seconds with bigger text
-        display_centered_message("Camera Starting! Take a picture of your waste with the capture button", 3)
+        # Show the startup hint over the preview for 3 seconds
+        compositor.clear()
+        compositor.set_layer("status", overlay.render_banner("Take a picture with the capture button"), duration=3)
         
         # Start the camera loop in a new thread.
         main_loop_thread = Thread(target=camera_feed_loop)
@@ -223,6 +371,7 @@ def start_camera_on_press():
     else:
         print(f"Start button pressed on GPIO {START_BUTTON_PIN}. Camera is already running. Stopping it...")
         camera_running = False
+        idle.wake()
         
         # Turn off all LEDs when stopping camera
         turn_off_all_leds()
@@ -231,30 +380,16 @@ def start_camera_on_press():
         if main_loop_thread and main_loop_thread.is_alive():
             main_loop_thread.join()
         
+        compositor.clear()
         device.clear()
 
 
-def simulate_api_call():
-    """Simulate API call for waste classification"""
-    # TODO: Replace this with actual API call
-    time.sleep(3)  # Simulate processing time
-    # Simulate a random waste type number between 1 and 4.
-    result_number = random.randint(1, 4)
-    results = {
-        1: "Rubbish",
-        2: "Recyclable",
-        3: "Organics",
-        4: "Ecowaste"
-    }
-    result_name = results.get(result_number, "Unknown")
-    return result_name, result_number
-
 def blink_leds_during_processing():
     """Blink LEDs in sequence during API processing"""
     leds = [blue_led, red_led, yellow_led, green_led]
     led_index = 0
     
-    while camera_running == "processing":
+    while classifying:
         # Turn off all LEDs
         turn_off_all_leds()
         # Turn on current LED
@@ -293,93 +428,264 @@ def turn_on_led_by_waste_type(wastetype):
     else:
         print(f"Warning: Unknown waste type number: {wastetype}. No LED will be turned on.")
 
+def start_processing_feedback():
+    """Show the classifying status over the preview and start blinking the LEDs."""
+    global classifying, led_thread
+    compositor.clear_layer("result")
+    compositor.set_layer("status", overlay.render_banner("Image captured, classifying waste..."))
+    compositor.set_layer("spinner", overlay.render_spinner())
+    
+    # Set processing state and start LED blinking
+    classifying = True
+    led_thread = Thread(target=blink_leds_during_processing)
+    led_thread.daemon = True
+    led_thread.start()
+
+def stop_processing_feedback():
+    """Stop LED blinking and wait for thread to finish"""
+    global classifying
+    classifying = False
+    if led_thread and led_thread.is_alive():
+        led_thread.join(timeout=1)
+    compositor.clear_layer("spinner")
+
+def show_classification_result(result_name, result_number, latency_ms, waste_name=None):
+    """Light the LED and show the result badge for a successful classification."""
+    stop_processing_feedback()
+    metrics.record_classification("success", latency_ms / 1000)
+    event_log.result(result_number, latency_ms)
+    
+    # Now that the result is back, turn on the correct LED
+    turn_on_led_by_waste_type(result_number)
+    
+    # Show the result badge until the next capture
+    compositor.set_layer("result", overlay.render_result_badge(result_number, result_name, waste_name))
+    compositor.set_layer("status", overlay.render_banner("Press capture for the next item"), duration=5)
+
+def show_classification_failure(outcome, error):
+    """Report a failed or timed out classification over the preview."""
+    stop_processing_feedback()
+    turn_off_all_leds()
+    metrics.record_classification(outcome)
+    event_log.failure(outcome)
+    compositor.set_layer("status", overlay.render_banner("Classification failed. Try again"), duration=3)
+    print(f"API call failed: {error}")
+
+def on_worker_result(reply, context):
+    """Called from the worker listener thread when a classification is done."""
+    for stage, seconds in reply["stages"].items():
+        metrics.record_stage(stage, seconds)
+        event_log.stage(stage, seconds)
+    if "jpeg_size" in reply:
+        event_log.capture(reply["jpeg_size"], reply["stages"]["encode"] * 1000)
+    metrics.classification_queue_depth.set(classification_worker.queue_depth())
+    if reply["ok"]:
+        print(f"Image archived as {reply['image_hash'][:12]}")
+        if "routing" in reply:
+            routing = reply["routing"]
+            print(f"Classified by {routing['host']}" + (" (hedged)" if routing["hedged"] else ""))
+            # The worker sends preview frames, so the size and quality are
+            # fixed, but the link and inference times still count. Everything
+            # but the request itself (queueing, encoding, archiving) is local.
+            timing = reply["timing"]
+            decision = quality_controller.fixed_decision((worker_config.FRAME_SHAPE[1], worker_config.FRAME_SHAPE[0]),
+                                                         worker_config.JPEG_QUALITY)
+            quality_controller.record(decision, reply["jpeg_size"], reply["latency_ms"] - timing["total_ms"],
+                                      timing["upload_bytes"], timing["total_ms"], timing["server_ms"],
+                                      reply["result_name"], reply["latency_ms"])
+        show_classification_result(reply["result_name"], reply["result_number"], reply["latency_ms"],
+                                   reply.get("waste_name"))
+    else:
+        show_classification_failure(reply["outcome"], reply["error"])
+
+def capture_adaptive_still(decision):
+    """
+    Capture a still at the resolution picked by the quality controller, crop it
+    around the centre and encode it at the chosen JPEG quality.
+    """
+    # BGR888 arrays come out in R, G, B order, ready for Pillow.
+    still_config = picam2.create_still_configuration(main={"size": decision["size"], "format": "BGR888"})
+    image = Image.fromarray(picam2.switch_mode_and_capture_array(still_config))
+    if decision["crop"] < 1.0:
+        crop_width = int(image.width * decision["crop"])
+        crop_height = int(image.height * decision["crop"])
+        left = (image.width - crop_width) // 2
+        top = (image.height - crop_height) // 2
+        image = image.crop((left, top, left + crop_width, top + crop_height))
+    image_buffer = io.BytesIO()
+    image.save(image_buffer, format="JPEG", quality=decision["quality"])
+    return image_buffer.getvalue()
+
 def capture_and_save_on_press():
     """
-    Callback function to take a single picture and save it.
-    This function is triggered by the gpiozero event.
+    Callback function to take a single picture, save it and classify it.
+    This function is triggered by the gpiozero event. The preview keeps
+    running, progress and the result are drawn over it by the compositor.
     """
-    global picam2, camera_running, led_thread
-    if picam2 and camera_running == True:  # Only proceed if camera is actually running (not "processing")
+    global start_press_is_gesture
+
+    # Part of the profiler gesture (start button held first), so releasing the
+    # start button must not start or stop the camera either.
+    if start_button.is_pressed:
+        start_press_is_gesture = True
+        return
+    event_log.press("capture")
+
+    # A press while the screen is dimmed or off only wakes the bin up.
+    if camera_running and idle.activity("capture button") in idle_policy.WAKE_UP_STAGES:
+        print(f"Capture button pressed on GPIO {CAPTURE_BUTTON_PIN}. Waking up from idle.")
+        return
+
+    if picam2 and camera_running and not classifying:
+        print(f"Capture button pressed on GPIO {CAPTURE_BUTTON_PIN}. Capturing image...")
+        
+        if classification_worker:
+            # The newest frame in the ring is the capture, the worker process
+            # does the rest and reports back through on_worker_result.
+            start_processing_feedback()
+            classification_worker.submit()
+            metrics.classification_queue_depth.set(classification_worker.queue_depth())
+            return
+        
         try:
-            print(f"Capture button pressed on GPIO {CAPTURE_BUTTON_PIN}. Capturing image...")
+            press_time = time.perf_counter()
             
             # Wait a moment to ensure camera feed is stable
             time.sleep(0.1)
             
-            # Capture a high-resolution still image from the running preview.
-            filename = f"image_{int(time.time())}.jpg"
-            picam2.capture_file(filename)
-            print(f"Image saved as {filename}")
-
-            # Now stop the camera feed after successful capture
-            camera_running = False
-            
-            # Wait for the camera thread to finish completely
-            if main_loop_thread and main_loop_thread.is_alive():
-                main_loop_thread.join()
-
-            # Display processing message
-            display_centered_message("Image captured, classifying waste...", 1)
-            
-            # Set processing state and start LED blinking
-            camera_running = "processing"
-            led_thread = Thread(target=blink_leds_during_processing)
-            led_thread.daemon = True
-            led_thread.start()
+            # Capture a high-resolution still image from the running preview
+            # into memory and store it in the archive under its content hash.
+            capture_start = time.perf_counter()
+            if inference_router:
+                decision = quality_controller.choose()
+                jpeg_bytes = capture_adaptive_still(decision)
+            else:
+                image_buffer = io.BytesIO()
+                picam2.capture_file(image_buffer, format="jpeg")
+                jpeg_bytes = image_buffer.getvalue()
+            archive_start = time.perf_counter()
+            capture_id, image_hash = archive.store(jpeg_bytes)
+            archive_done = time.perf_counter()
+            metrics.record_stage("capture_still", archive_start - capture_start)
+            metrics.record_stage("archive", archive_done - archive_start)
+            event_log.capture(len(jpeg_bytes), (archive_start - capture_start) * 1000)
+            event_log.stage("capture_still", archive_start - capture_start)
+            event_log.stage("archive", archive_done - archive_start)
+            print(f"Image archived as {image_hash[:12]}")
+
+            start_processing_feedback()
             
+            metrics.classification_queue_depth.inc()
             try:
-                # Simulate API call (replace with actual API call)
-                result_name, result_number = simulate_api_call()
+                classify_start = time.perf_counter()
+                waste_name = None
+                if inference_router:
+                    response = inference_router.classify(jpeg_bytes)
+                    routing = response["routing"]
+                    print(f"Classified by {routing['host']}" + (" (hedged)" if routing["hedged"] else ""))
+                    result_name = response["waste_category"]
+                    result_number = response["waste_type"]
+                    waste_name = response.get("waste_name")
+                else:
+                    # Simulate API call
+                    result_name, result_number = simulate_api_call()
+                classify_seconds = time.perf_counter() - classify_start
+                metrics.record_stage("classify", classify_seconds)
+                event_log.stage("classify", classify_seconds)
                 
-                # Stop LED blinking and wait for thread to finish
-                camera_running = False
-                if led_thread and led_thread.is_alive():
-                    led_thread.join(timeout=1)
-                
-                # Now that the result is back, turn on the correct LED
-                turn_on_led_by_waste_type(result_number)
-                
-                # Display success message
-                display_centered_message(f"Classification complete! {result_name}. Press start to classify another item", 5)
+                # Link the result and button-to-result latency to the capture
+                latency_ms = (time.perf_counter() - press_time) * 1000
+                if inference_router:
+                    # Feed the measured local, upload and inference time back
+                    # into the controller. Local time runs from the press to the
+                    # request, so it includes the settle delay and archiving.
+                    timing = response["timing"]
+                    quality_controller.record(decision, len(jpeg_bytes), (classify_start - press_time) * 1000,
+                                              timing["upload_bytes"], timing["total_ms"], timing["server_ms"],
+                                              result_name, latency_ms)
+                archive.record_result(capture_id, result_name, result_number, latency_ms)
+                show_classification_result(result_name, result_number, latency_ms, waste_name)
                 
             except Exception as api_error:
-                # Stop LED blinking and wait for thread to finish
-                camera_running = False
-                if led_thread and led_thread.is_alive():
-                    led_thread.join(timeout=1)
-                turn_off_all_leds()
-                
-                # Display error message
-                display_centered_message("Classification failed. Press start to try again", 3)
-                print(f"API call failed: {api_error}")
+                # A timed out request is counted separately from other failures
+                outcome = "timeout" if isinstance(api_error, TimeoutError) else "failure"
+                show_classification_failure(outcome, api_error)
+            finally:
+                metrics.classification_queue_depth.dec()
             
         except Exception as e:
-            camera_running = False
+            stop_processing_feedback()
             turn_off_all_leds()
+            compositor.set_layer("status", overlay.render_banner("Capture failed. Try again"), duration=3)
             print(f"Failed to capture image: {e}")
+    elif classifying:
+        print(f"Capture button pressed on GPIO {CAPTURE_BUTTON_PIN}. Still classifying the last image.")
     else:
         print(f"Capture button pressed on GPIO {CAPTURE_BUTTON_PIN}. Cannot capture. Camera is not running.")
         
 # -----------------------------------------------------------------------------
 # Main Program
 # -----------------------------------------------------------------------------
-print("Program is starting...")
-
-# Ensure all LEDs are off at startup
-turn_off_all_leds()
-
-# Add event detection for the buttons using gpiozero's 'when_pressed' handler.
-start_button.when_pressed = start_camera_on_press
-capture_button.when_pressed = capture_and_save_on_press
-
-print("Ready. Press the start button to begin the camera feed.")
-print("Press the capture button to take a photo.")
-print("Press Ctrl+C to exit.")
-
-# The 'pause()' function keeps the program running and listening for events.
-try:
-    pause()
-except KeyboardInterrupt:
-    print("\nProgram stopped.")
-    # Turn off all LEDs when exiting
-    turn_off_all_leds()
\ No newline at end of file
+def main():
+    global archive, event_log, inference_router, classification_worker
+
+    print("Program is starting...")
+
+    setup_display()
+    setup_buttons_and_leds()
+
+    # Open the capture archive and its index.
+    archive = CaptureArchive(ARCHIVE_DIR)
+    event_log = EventLog(EVENT_LOG_DIR, BIN_ID)
+
+    if INFERENCE_URLS and not USE_CLASSIFICATION_WORKER:
+        inference_router = InferenceRouter(INFERENCE_URLS)
+        metrics.watch_inference_router(inference_router)
+
+    # Serve the Prometheus metrics from a background thread.
+    metrics.start_metrics_server()
+
+    # Start the classification process and its shared frame ring if enabled.
+    if USE_CLASSIFICATION_WORKER:
+        classification_worker = ClassificationWorker(ARCHIVE_DIR, on_worker_result, inference_urls=INFERENCE_URLS)
+
+    # Ensure all LEDs are off at startup
+    turn_off_all_leds()
+
+    # Add event detection for the buttons using gpiozero's event handlers. The
+    # start button acts on release (see start_button_pressed).
+    start_button.when_pressed = start_button_pressed
+    start_button.when_released = start_camera_on_release
+    capture_button.when_pressed = capture_and_save_on_press
+
+    # Holding both buttons, or SIGUSR1, toggles the sampling profiler.
+    start_button.hold_time = PROFILE_HOLD_SECONDS
+    capture_button.hold_time = PROFILE_HOLD_SECONDS
+    start_button.when_held = on_button_held
+    capture_button.when_held = on_button_held
+    signal.signal(signal.SIGUSR1, on_profiler_signal)
+
+    print("Ready. Press the start button to begin the camera feed.")
+    print("Press the capture button to take a photo.")
+    print("Hold both buttons (start first) to record a profile.")
+    print("Press Ctrl+C to exit.")
+
+    # The 'pause()' function keeps the program running and listening for events.
+    # It returns after every signal handler (e.g. SIGUSR1), so it runs in a loop.
+    try:
+        while True:
+            pause()
+    except KeyboardInterrupt:
+        print("\nProgram stopped.")
+        # Turn off all LEDs when exiting
+        turn_off_all_leds()
+        if classification_worker:
+            classification_worker.stop()
+        if inference_router:
+            inference_router.close()
+        profiler.stop()
+        event_log.close()
+        archive.close()
+
+if __name__ == "__main__":
+    main()
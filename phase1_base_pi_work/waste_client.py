@@ -0,0 +1,109 @@
+import base64
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Seconds to wait for the inference machine before the request counts as a timeout.
+REQUEST_TIMEOUT = 30
+
+# -----------------------------------------------------------------------------
+# Cancellation
+# -----------------------------------------------------------------------------
+class RequestCancelled(Exception):
+    """Raised by classify_image when its cancel token was triggered."""
+
+class CancelToken:
+    """
+    Lets another thread abort a classification request, e.g. the slower one of
+    a hedged pair. Cancelling shuts the socket down, which unblocks the reader
+    and tells llm_processor.py to stop the Ollama request.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def attach(self, connection):
+        with self.lock:
+            self.connection = connection
+            return not self.cancelled
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.connection is not None and self.connection.sock is not None:
+                try:
+                    self.connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+# -----------------------------------------------------------------------------
+# Classification Calls
+# -----------------------------------------------------------------------------
+# Kept free of any hardware setup so it can be imported by the classification
+# worker process as well as by takepicrpicam.py.
+
+def simulate_api_call():
+    """Simulate API call for waste classification"""
+    # TODO: Replace this with actual API call
+    time.sleep(3)  # Simulate processing time
+    # Simulate a random waste type number between 1 and 4.
+    result_number = random.randint(1, 4)
+    results = {
+        1: "Rubbish",
+        2: "Recyclable",
+        3: "Organics",
+        4: "Ecowaste"
+    }
+    result_name = results.get(result_number, "Unknown")
+    return result_name, result_number
+
+def classify_image(jpeg_bytes, url, timeout=REQUEST_TIMEOUT, cancel_token=None):
+    """
+    Send a JPEG to llm_processor.py on the inference machine.
+
+    Returns the result dict from the server (waste_category, waste_name,
+    waste_type) with an extra "timing" entry: the bytes uploaded, the total
+    request time and the inference time reported by the server, all measured
+    so the capture quality can be adapted to the link. If cancel_token is
+    cancelled while waiting, RequestCancelled is raised.
+    """
+    target = urlsplit(url)
+    body = json.dumps({"image": base64.b64encode(jpeg_bytes).decode("ascii")}).encode("utf-8")
+
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=timeout)
+    try:
+        connection.connect()
+        if cancel_token is not None and not cancel_token.attach(connection):
+            raise RequestCancelled("request cancelled")
+        connection.request("POST", target.path or "/classify", body=body,
+                           headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        data = json.loads(response.read())
+    except (OSError, http.client.HTTPException, ValueError):
+        # A cancelled request fails with whatever error the shut down socket causes.
+        if cancel_token is not None and cancel_token.cancelled:
+            raise RequestCancelled("request cancelled")
+        raise
+    finally:
+        connection.close()
+    total_ms = (time.perf_counter() - start) * 1000
+
+    if response.status != 200:
+        raise RuntimeError(f"Inference server returned HTTP {response.status}: {data.get('error')}")
+
+    data["timing"] = {
+        "upload_bytes": len(body),
+        "total_ms": total_ms,
+        "server_ms": data.get("stats", {}).get("total_ms"),
+    }
+    return data
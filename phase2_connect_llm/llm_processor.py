@@ -0,0 +1,692 @@
+import argparse
+import base64
+import http.client
+import io
+import json
+import re
+import select
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from PIL import Image, ImageEnhance, ImageOps
+
+from rule_pack import RulePackManager
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# The Ollama instance running on the inference machine (see the phase 2 README).
+OLLAMA_URL = "http://localhost:11434"
+MODEL_NAME = "qwen2.5vl:7b"
+
+# The address the Raspberry Pi sends its base64 images to.
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 5000
+
+# "constrained" asks Ollama for grammar-constrained JSON that can only contain
+# one of the four categories and a short item name. "free" is the original
+# free-text prompt that has to be analyzed and adjusted afterwards.
+DEFAULT_MODE = "constrained"
+
+# Cap on the item name the model may generate in constrained mode. Every extra
+# token costs GPU time, and the name only has to fit on the 320x240 LCD.
+MAX_WASTE_NAME_LENGTH = 32
+
+# Hard stop for generation in constrained mode. The JSON for the longest
+# allowed answer is well below this, it is only a backstop.
+MAX_CONSTRAINED_TOKENS = 40
+
+# How long to wait for Ollama before giving up on a request.
+OLLAMA_TIMEOUT = 60
+
+# The waste categories and their waste_type numbers, as the Raspberry Pi expects
+# them (1 = red, 2 = yellow, 3 = green, 4 = blue LED).
+WASTE_TYPES = {
+    "Rubbish": 1,
+    "Recyclable": 2,
+    "Organics": 3,
+    "EcoWaste": 4,
+}
+
+# Other spellings the model likes to use in free-text answers.
+CATEGORY_ALIASES = {
+    "rubbish": "Rubbish",
+    "landfill": "Rubbish",
+    "general waste": "Rubbish",
+    "recyclable": "Recyclable",
+    "recycling": "Recyclable",
+    "recycle": "Recyclable",
+    "organics": "Organics",
+    "organic": "Organics",
+    "compost": "Organics",
+    "ecowaste": "EcoWaste",
+    "eco waste": "EcoWaste",
+    "ecodrop": "EcoWaste",
+    "eco drop": "EcoWaste",
+    "hazardous": "EcoWaste",
+}
+
+# Whole-word category mentions in a free-text answer (plural allowed), with
+# an optional negation in front, e.g. "not recyclable" or "can't go in the
+# organics". Longer aliases are tried first.
+CATEGORY_MENTION = re.compile(
+    r"(?P<negation>\b(?:not|no|never|isn't|aren't|can't|cannot|shouldn't)\s+"
+    r"(?:(?:a|an|the|be|in|into|go|goes|put)\s+)*)?"
+    r"\b(?P<alias>" + "|".join(re.escape(alias) for alias in sorted(CATEGORY_ALIASES, key=len, reverse=True))
+    + r")s?\b")
+
+# JSON schema passed to Ollama's "format" field. Ollama turns this into a
+# grammar, so the model cannot produce anything outside of it. The waste_type
+# number is not generated at all, it is looked up from the category.
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "waste_name": {"type": "string", "maxLength": MAX_WASTE_NAME_LENGTH},
+        "waste_category": {"type": "string", "enum": list(WASTE_TYPES)},
+    },
+    "required": ["waste_name", "waste_category"],
+}
+
+CONSTRAINED_PROMPT = (
+    "Identify the waste item in this image and classify it as Rubbish, "
+    "Recyclable, Organics or EcoWaste. Give a short item name."
+)
+
+FREE_PROMPT = (
+    "Analyze the object in this image. Is it 'rubbish', 'organics', "
+    "'recyclable', or 'ecodrop'? Respond in JSON with the keys "
+    "'waste_category' and 'waste_name'."
+)
+
+# Correct the model's category with the local council rules in rule_packs/.
+# The file is reloaded automatically when it changes.
+USE_RULE_PACK = True
+
+# Number of variants classified in parallel in "vote" mode. Ollama must be
+# started with OLLAMA_NUM_PARALLEL of at least this so they really run together.
+VOTE_COUNT = 5
+
+# Different phrasings of the constrained prompt, one per variant in turn.
+VOTE_PROMPTS = [
+    CONSTRAINED_PROMPT,
+    "Which bin does this item belong in: Rubbish, Recyclable, Organics or "
+    "EcoWaste? Give a short item name.",
+    "Name the main object in the picture and say whether it is Rubbish, "
+    "Recyclable, Organics or EcoWaste.",
+]
+
+# Running totals per mode, used for the /stats endpoint and the comparison
+# report. Guarded by stats_lock as the server handles requests in threads.
+stats_lock = threading.Lock()
+mode_stats = {}
+vote_stats = {
+    "requests": 0, "agreement": 0.0, "unanimous": 0, "early_exits": 0,
+    "cancelled_variants": 0, "wasted_tokens": 0,
+}
+
+rule_pack_manager = RulePackManager() if USE_RULE_PACK else None
+
+# How often a running /classify request checks whether the Raspberry Pi is
+# still waiting. A Pi that got its answer from another host closes the
+# connection, and the Ollama request is cancelled.
+CLIENT_CHECK_SECONDS = 0.2
+
+# Requests currently being classified, reported at GET /health so the Pi can
+# route around a busy machine. Guarded by stats_lock.
+active_requests = 0
+
+# -----------------------------------------------------------------------------
+# Ollama Communication
+# -----------------------------------------------------------------------------
+class RequestCancelled(Exception):
+    """Raised by call_ollama when its cancel token was triggered."""
+
+    def __init__(self, generated_tokens):
+        super().__init__("request cancelled")
+        self.generated_tokens = generated_tokens
+
+class CancelToken:
+    """
+    Lets another thread abort a streaming Ollama request. Cancelling shuts the
+    socket down, which unblocks the reader and makes Ollama stop generating.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.connection = None
+        self.children = []
+        self.lock = threading.Lock()
+
+    def attach(self, connection):
+        with self.lock:
+            self.connection = connection
+            return not self.cancelled
+
+    def add_child(self, child):
+        """Cancel child together with this token (e.g. the variants of a vote)."""
+        with self.lock:
+            if not self.cancelled:
+                self.children.append(child)
+                return
+        child.cancel()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            children, self.children = self.children, []
+            if self.connection is not None and self.connection.sock is not None:
+                try:
+                    self.connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        for child in children:
+            child.cancel()
+
+def call_ollama(prompt, image_b64, response_format=None, max_tokens=None, cancel_token=None):
+    """
+    Send a single chat request with an image to Ollama and stream the answer.
+
+    Returns a tuple of (content, stats) where stats holds the number of
+    generated tokens and the decode time reported by Ollama. If cancel_token
+    is cancelled while waiting, RequestCancelled is raised.
+    """
+    url = urlsplit(OLLAMA_URL)
+    payload = {
+        "model": MODEL_NAME,
+        "messages": [{"role": "user", "content": prompt, "images": [image_b64]}],
+        "stream": True,
+        "options": {"temperature": 0},
+    }
+    if response_format is not None:
+        payload["format"] = response_format
+    if max_tokens is not None:
+        payload["options"]["num_predict"] = max_tokens
+
+    start_time = time.perf_counter()
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=OLLAMA_TIMEOUT)
+    response = None
+    content_parts = []
+    final_chunk = {}
+    try:
+        connection.connect()
+        if cancel_token is not None and not cancel_token.attach(connection):
+            raise RequestCancelled(0)
+        connection.request("POST", "/api/chat", body=json.dumps(payload),
+                           headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"Ollama returned HTTP {response.status}: {response.read()[:200]!r}")
+
+        # Ollama streams one JSON object per line (roughly one per token),
+        # the last one carries the timings.
+        for line in response:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise RequestCancelled(len(content_parts))
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            content_parts.append(chunk.get("message", {}).get("content", ""))
+            if chunk.get("done"):
+                final_chunk = chunk
+                break
+    except (OSError, http.client.HTTPException, ValueError):
+        # A cancelled request fails with whatever error the shut down socket causes.
+        if cancel_token is not None and cancel_token.cancelled:
+            raise RequestCancelled(len(content_parts))
+        raise
+    finally:
+        # The response holds its own reference to the socket. Close it too, so
+        # the socket is really closed and Ollama sees the client go away, even
+        # while the exception (and this frame) is still referenced.
+        if response is not None:
+            response.close()
+        connection.close()
+    if cancel_token is not None and cancel_token.cancelled and not final_chunk:
+        raise RequestCancelled(len(content_parts))
+
+    stats = {
+        "generated_tokens": final_chunk.get("eval_count", 0),
+        "prompt_tokens": final_chunk.get("prompt_eval_count", 0),
+        # Ollama reports durations in nanoseconds.
+        "decode_ms": final_chunk.get("eval_duration", 0) / 1e6,
+        "total_ms": (time.perf_counter() - start_time) * 1000,
+    }
+    return "".join(content_parts), stats
+
+# -----------------------------------------------------------------------------
+# Response Parsing
+# -----------------------------------------------------------------------------
+def normalize_category(value):
+    """Map a category spelling from the model to one of the WASTE_TYPES keys, or None."""
+    if not isinstance(value, str):
+        return None
+    if value in WASTE_TYPES:
+        return value
+    return CATEGORY_ALIASES.get(value.strip().strip("'\".").lower())
+
+def build_result(category, name):
+    """Build the JSON structure the Raspberry Pi understands."""
+    if category is None:
+        # waste_type 0 tells the Pi not to light any LED.
+        return {"waste_category": "Unknown", "waste_name": name or "Unknown", "waste_type": 0}
+    name = (name or "Unknown").strip()[:MAX_WASTE_NAME_LENGTH]
+    return {"waste_category": category, "waste_name": name, "waste_type": WASTE_TYPES[category]}
+
+def parse_strict(content):
+    """
+    Fast path for constrained responses: a plain json.loads and an exact check
+    of the enum. Returns None if the answer does not match the schema.
+    """
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    category = data.get("waste_category")
+    name = data.get("waste_name")
+    if category not in WASTE_TYPES or not isinstance(name, str):
+        return None
+    return build_result(category, name)
+
+def parse_lenient(content):
+    """
+    Slow path for free-text answers (or a constrained answer that was cut
+    short): look for a JSON object anywhere in the text, then fall back to
+    searching for category words.
+    """
+    category = None
+    name = None
+
+    match = re.search(r"\{.*?\}", content, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            if isinstance(data, dict):
+                category = normalize_category(data.get("waste_category"))
+                name = data.get("waste_name") if isinstance(data.get("waste_name"), str) else None
+        except ValueError:
+            pass
+
+    if category is None:
+        # Use the last category named that is not negated, answers tend to
+        # end with the conclusion ("not recyclable, put it in rubbish").
+        for mention in CATEGORY_MENTION.finditer(content.lower()):
+            if not mention.group("negation"):
+                category = CATEGORY_ALIASES[mention.group("alias")]
+
+    return build_result(category, name)
+
+def apply_rule_pack(result):
+    """
+    Confirm or override the model's category with the local council rules,
+    matched on the waste name. An override is noted in "rule_override".
+    """
+    if rule_pack_manager is None:
+        return result
+    rule = rule_pack_manager.check(result["waste_name"], result["waste_category"])
+    if rule is not None and rule["category"] != result["waste_category"]:
+        result["rule_override"] = {"model_category": result["waste_category"], "rule": rule["item"]}
+        result["waste_category"] = rule["category"]
+        result["waste_type"] = WASTE_TYPES[rule["category"]]
+    return result
+
+def parse_response(content):
+    """Parse a model answer, returns (result, parse_method)."""
+    result = parse_strict(content)
+    if result is not None:
+        return result, "strict"
+    return parse_lenient(content), "lenient"
+
+# -----------------------------------------------------------------------------
+# Classification
+# -----------------------------------------------------------------------------
+def record_stats(mode, stats, parse_method):
+    """Add one request to the running totals of a mode."""
+    with stats_lock:
+        totals = mode_stats.setdefault(mode, {
+            "requests": 0, "generated_tokens": 0, "decode_ms": 0.0,
+            "total_ms": 0.0, "lenient_parses": 0,
+        })
+        totals["requests"] += 1
+        totals["generated_tokens"] += stats["generated_tokens"]
+        totals["decode_ms"] += stats["decode_ms"]
+        totals["total_ms"] += stats["total_ms"]
+        if parse_method == "lenient":
+            totals["lenient_parses"] += 1
+
+def get_stats_summary():
+    """Averages per mode, for the /stats endpoint and the comparison report."""
+    with stats_lock:
+        summary = {}
+        for mode, totals in mode_stats.items():
+            count = max(totals["requests"], 1)
+            summary[mode] = {
+                "requests": totals["requests"],
+                "avg_generated_tokens": totals["generated_tokens"] / count,
+                "avg_decode_ms": totals["decode_ms"] / count,
+                "avg_total_ms": totals["total_ms"] / count,
+                "lenient_parses": totals["lenient_parses"],
+            }
+        if rule_pack_manager is not None:
+            summary["rules"] = rule_pack_manager.report()
+        if vote_stats["requests"]:
+            count = vote_stats["requests"]
+            summary.setdefault("vote", {}).update({
+                "avg_agreement": vote_stats["agreement"] / count,
+                "unanimous_rate": vote_stats["unanimous"] / count,
+                "early_exit_rate": vote_stats["early_exits"] / count,
+                "cancelled_variants": vote_stats["cancelled_variants"],
+                "wasted_tokens": vote_stats["wasted_tokens"],
+            })
+        return summary
+
+def classify_image(image_b64, mode=DEFAULT_MODE, cancel_token=None):
+    """
+    Classify a base64 encoded image.
+
+    Returns the result for the Raspberry Pi with an extra "stats" entry holding
+    the generated token count and decode time of this request.
+    """
+    if mode == "constrained":
+        content, stats = call_ollama(CONSTRAINED_PROMPT, image_b64,
+                                     response_format=CLASSIFICATION_SCHEMA,
+                                     max_tokens=MAX_CONSTRAINED_TOKENS,
+                                     cancel_token=cancel_token)
+    elif mode == "free":
+        content, stats = call_ollama(FREE_PROMPT, image_b64, cancel_token=cancel_token)
+    elif mode == "vote":
+        return classify_with_votes(image_b64, cancel_token=cancel_token)
+    else:
+        raise ValueError(f"Unknown classification mode: {mode}")
+
+    result, parse_method = parse_response(content)
+    apply_rule_pack(result)
+    record_stats(mode, stats, parse_method)
+
+    stats["mode"] = mode
+    stats["parse"] = parse_method
+    result["stats"] = stats
+    print(f"[{mode}] {result['waste_category']} ({result['waste_name']}): "
+          f"{stats['generated_tokens']} tokens, {stats['decode_ms']:.0f} ms decode, "
+          f"{stats['total_ms']:.0f} ms total, {parse_method} parse")
+    return result
+
+# -----------------------------------------------------------------------------
+# Self-Consistency Voting
+# -----------------------------------------------------------------------------
+def encode_image(image):
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=90)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def make_vote_variants(image_b64, count):
+    """
+    Build `count` (label, prompt, image_b64) variants of one capture by
+    combining small image changes with different prompt phrasings.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+    image.load()
+
+    def centre_crop(img):
+        width, height = img.size
+        return img.crop((width // 10, height // 10, width - width // 10, height - height // 10))
+
+    transforms = [
+        ("original", None),
+        ("centre_crop", centre_crop),
+        ("mirrored", ImageOps.mirror),
+        ("brighter", lambda img: ImageEnhance.Brightness(img).enhance(1.2)),
+        ("contrast", lambda img: ImageEnhance.Contrast(img).enhance(1.3)),
+    ]
+    variants = []
+    for index in range(count):
+        label, transform = transforms[index % len(transforms)]
+        prompt_index = index % len(VOTE_PROMPTS)
+        variant_b64 = image_b64 if transform is None else encode_image(transform(image))
+        variants.append((f"{label}/prompt{prompt_index}", VOTE_PROMPTS[prompt_index], variant_b64))
+    return variants
+
+def record_wasted(future):
+    """Done callback of a vote variant: count the tokens a cancelled variant had generated."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if isinstance(error, RequestCancelled):
+        with stats_lock:
+            vote_stats["wasted_tokens"] += error.generated_tokens
+
+def classify_with_votes(image_b64, count=VOTE_COUNT, cancel_token=None):
+    """
+    Classify `count` variants of the image concurrently and vote on the category.
+
+    As soon as no other category can catch up with the leader any more, the
+    outstanding variants are cancelled, so the added latency stays close to a
+    single call. The result carries a "confidence" (share of votes for the
+    category it returns) and vote statistics. If the rule pack overrode the
+    winner, the winner's share is kept as "model_confidence" in "rule_override". Cancelling cancel_token cancels all variants
+    and raises RequestCancelled.
+    """
+    start_time = time.perf_counter()
+    variants = make_vote_variants(image_b64, count)
+    cancel_tokens = [CancelToken() for _ in variants]
+    if cancel_token is not None:
+        for variant_token in cancel_tokens:
+            cancel_token.add_child(variant_token)
+
+    executor = ThreadPoolExecutor(max_workers=count)
+    futures = {}
+    for (label, prompt, variant_b64), variant_token in zip(variants, cancel_tokens):
+        future = executor.submit(call_ollama, prompt, variant_b64, CLASSIFICATION_SCHEMA,
+                                 MAX_CONSTRAINED_TOKENS, variant_token)
+        future.add_done_callback(record_wasted)
+        futures[future] = (label, variant_token)
+
+    votes = {}
+    finished = 0
+    generated_tokens = 0
+    decode_ms = 0.0
+    variant_ms = []
+    early_exit = False
+    try:
+        for future in as_completed(futures):
+            finished += 1
+            label = futures[future][0]
+            try:
+                content, stats = future.result()
+            except Exception as e:
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                # A failed variant is an abstention.
+                print(f"Vote variant {label} failed: {e}")
+                continue
+            generated_tokens += stats["generated_tokens"]
+            decode_ms += stats["decode_ms"]
+            variant_ms.append(stats["total_ms"])
+            result, _ = parse_response(content)
+            if result["waste_type"]:
+                votes.setdefault(result["waste_category"], []).append(result["waste_name"])
+
+            # Stop once the leader cannot be caught even if every outstanding
+            # variant voted for the runner-up.
+            counts = sorted((len(names) for names in votes.values()), reverse=True)
+            leader = counts[0] if counts else 0
+            runner_up = counts[1] if len(counts) > 1 else 0
+            if finished < count and leader > runner_up + (count - finished):
+                early_exit = True
+                break
+    finally:
+        cancelled = 0
+        for future, (label, variant_token) in futures.items():
+            if not future.done():
+                variant_token.cancel()
+                cancelled += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+    if cancel_token is not None and cancel_token.cancelled:
+        raise RequestCancelled(generated_tokens)
+
+    votes_cast = sum(len(names) for names in votes.values())
+    if votes:
+        # Ties go to the category that was voted for first.
+        winner = max(votes, key=lambda category: len(votes[category]))
+        name = Counter(votes[winner]).most_common(1)[0][0]
+        agreement = len(votes[winner]) / votes_cast
+    else:
+        winner, name, agreement = None, None, 0.0
+    result = apply_rule_pack(build_result(winner, name))
+    if "rule_override" in result:
+        # The votes were for the model's category, not the rule's.
+        result["rule_override"]["model_confidence"] = agreement
+        result["confidence"] = len(votes.get(result["waste_category"], [])) / votes_cast if votes_cast else 0.0
+    else:
+        result["confidence"] = agreement
+
+    stats = {
+        "mode": "vote",
+        "variants": count,
+        "completed": finished,
+        "cancelled": cancelled,
+        "votes": {category: len(names) for category, names in votes.items()},
+        "generated_tokens": generated_tokens,
+        "decode_ms": decode_ms,
+        "total_ms": (time.perf_counter() - start_time) * 1000,
+        "avg_variant_ms": sum(variant_ms) / len(variant_ms) if variant_ms else 0.0,
+        "parse": "strict",
+    }
+    record_stats("vote", stats, "strict")
+    with stats_lock:
+        vote_stats["requests"] += 1
+        vote_stats["agreement"] += agreement
+        vote_stats["unanimous"] += 1 if len(votes) == 1 else 0
+        vote_stats["early_exits"] += 1 if early_exit else 0
+        vote_stats["cancelled_variants"] += cancelled
+    result["stats"] = stats
+    print(f"[vote] {result['waste_category']} ({result['waste_name']}): votes {stats['votes']}, "
+          f"confidence {result['confidence']:.2f}, {cancelled} cancelled, {stats['total_ms']:.0f} ms total "
+          f"vs {stats['avg_variant_ms']:.0f} ms per variant")
+    return result
+
+def compare_modes(image_paths, runs=3, modes=("free", "constrained")):
+    """Classify the same images in each mode and print the average cost of each."""
+    for path in image_paths:
+        with open(path, "rb") as image_file:
+            image_b64 = base64.b64encode(image_file.read()).decode("ascii")
+        for _ in range(runs):
+            for mode in modes:
+                classify_image(image_b64, mode)
+
+    summary = get_stats_summary()
+    print()
+    print(f"{'mode':<12}{'requests':>10}{'tokens':>10}{'decode ms':>12}{'total ms':>12}{'lenient':>10}")
+    for mode, values in summary.items():
+        if mode == "rules":
+            continue
+        print(f"{mode:<12}{values['requests']:>10}{values['avg_generated_tokens']:>10.1f}"
+              f"{values['avg_decode_ms']:>12.0f}{values['avg_total_ms']:>12.0f}"
+              f"{values['lenient_parses']:>10}")
+    if "vote" in summary:
+        vote = summary["vote"]
+        print(f"Vote mode: {vote['avg_agreement']:.0%} average agreement, {vote['unanimous_rate']:.0%} unanimous, "
+              f"{vote['early_exit_rate']:.0%} early exits, {vote['cancelled_variants']} variants cancelled "
+              f"({vote['wasted_tokens']} tokens wasted).")
+    if "rules" in summary:
+        rules = summary["rules"]
+        print(f"Rule pack {rules['region']}: matched {rules['matched']} of {rules['checked']} names, "
+              f"confirmed {rules['confirmed']}, overrode the model {rules['overridden']} times "
+              f"({rules['override_rate']:.0%}).")
+    if "free" in summary and "constrained" in summary and summary["constrained"]["avg_total_ms"]:
+        print(f"Constrained mode generates {summary['free']['avg_generated_tokens'] / max(summary['constrained']['avg_generated_tokens'], 1):.1f}x "
+              f"fewer tokens and is {summary['free']['avg_total_ms'] / summary['constrained']['avg_total_ms']:.1f}x faster.")
+
+# -----------------------------------------------------------------------------
+# HTTP Server
+# -----------------------------------------------------------------------------
+class ClassificationHandler(BaseHTTPRequestHandler):
+    """Receives base64 images from the Raspberry Pi and answers with JSON."""
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, get_stats_summary())
+        elif self.path == "/health":
+            with stats_lock:
+                active = active_requests
+            self.send_json(200, {"status": "ok", "model": MODEL_NAME, "active_requests": active})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def watch_client(self, cancel_token, finished):
+        """Cancel the request if the Pi closes the connection before the answer."""
+        while not finished.wait(CLIENT_CHECK_SECONDS):
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            try:
+                closed = readable and not self.connection.recv(1, socket.MSG_PEEK)
+            except OSError:
+                closed = True
+            if closed:
+                cancel_token.cancel()
+                return
+
+    def do_POST(self):
+        global active_requests
+        if self.path != "/classify":
+            self.send_json(404, {"error": "not found"})
+            return
+        cancel_token = CancelToken()
+        finished = threading.Event()
+        with stats_lock:
+            active_requests += 1
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            threading.Thread(target=self.watch_client, args=(cancel_token, finished), daemon=True).start()
+            result = classify_image(request["image"], request.get("mode", DEFAULT_MODE), cancel_token)
+            self.send_json(200, result)
+        except RequestCancelled as e:
+            print(f"Request cancelled by the client after {e.generated_tokens} tokens.")
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"Classification error: {e}")
+            self.send_json(502, {"error": str(e)})
+        finally:
+            finished.set()
+            with stats_lock:
+                active_requests -= 1
+
+    def log_message(self, format, *args):
+        # The classification itself is already printed, keep the console readable.
+        pass
+
+# -----------------------------------------------------------------------------
+# Main Program
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Waste classification server for the Raspberry Pi.")
+    parser.add_argument("--compare", nargs="+", metavar="IMAGE",
+                        help="compare free and constrained mode on these images instead of serving")
+    parser.add_argument("--runs", type=int, default=3, help="runs per image and mode for --compare")
+    parser.add_argument("--modes", nargs="+", default=["free", "constrained"],
+                        choices=["free", "constrained", "vote"], help="modes to run for --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_modes(args.compare, args.runs, args.modes)
+    else:
+        server = ThreadingHTTPServer((SERVER_HOST, SERVER_PORT), ClassificationHandler)
+        print(f"Classification server listening on {SERVER_HOST}:{SERVER_PORT} (mode: {DEFAULT_MODE}).")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# The local council rules used to correct the model (see rule_packs/).
+RULE_PACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rule_packs", "christchurch.json")
+
+# How often the rule pack file is checked for changes.
+RELOAD_CHECK_SECONDS = 2.0
+
+# Must match the categories of llm_processor.py.
+VALID_CATEGORIES = ("Rubbish", "Recyclable", "Organics", "EcoWaste")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# -----------------------------------------------------------------------------
+# Normalization
+# -----------------------------------------------------------------------------
+def normalize_token(token):
+    """Very small singularizer so "batteries" matches "battery" and "boxes" matches "box"."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us")):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """Lowercase, split on anything that is not a letter or digit and singularize."""
+    return [normalize_token(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+# -----------------------------------------------------------------------------
+# Compiled Rule Pack
+# -----------------------------------------------------------------------------
+class CompiledRulePack:
+    """
+    An Aho-Corasick automaton over normalized tokens of every item and alias in
+    a rule pack.
+
+    One pass over the tokens of a waste_name finds all items it contains. The
+    longest match wins, so "coffee cup lid" beats "coffee cup", and on equal
+    length the rule listed first in the pack wins.
+    """
+
+    def __init__(self, rule_pack):
+        self.region = rule_pack.get("region", "unknown")
+        self.rules = []
+        # Node 0 is the root. Each node has its token transitions, a failure
+        # link and the best (rule, length) ending at that node.
+        self.transitions = [{}]
+        self.fail = [0]
+        self.output = [None]
+
+        for rule in rule_pack["rules"]:
+            category = rule["category"]
+            if category not in VALID_CATEGORIES:
+                raise ValueError(f"Rule '{rule['item']}' has unknown category '{category}'")
+            rule_index = len(self.rules)
+            self.rules.append({"item": rule["item"], "category": category})
+            for phrase in [rule["item"]] + rule.get("aliases", []):
+                self._add(tokenize(phrase), rule_index)
+        self._build_failure_links()
+
+    def _add(self, tokens, rule_index):
+        if not tokens:
+            return
+        node = 0
+        for token in tokens:
+            next_node = self.transitions[node].get(token)
+            if next_node is None:
+                next_node = len(self.transitions)
+                self.transitions.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.transitions[node][token] = next_node
+            node = next_node
+        if self.output[node] is None or self.output[node][1] < len(tokens):
+            self.output[node] = (rule_index, len(tokens))
+
+    def _build_failure_links(self):
+        """Breadth-first pass that links every node to its longest proper suffix."""
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.transitions[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(token, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                # Merge the suffix output so every match is seen without
+                # walking the failure chain at match time.
+                suffix = self.output[self.fail[child]]
+                if suffix is not None and (self.output[child] is None or self.output[child][1] < suffix[1]):
+                    self.output[child] = suffix
+
+    def match(self, text):
+        """Return the matching rule dict for a waste name, or None."""
+        transitions = self.transitions
+        fail = self.fail
+        output = self.output
+        node = 0
+        best = None
+        for token in tokenize(text):
+            while node and token not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(token, 0)
+            found = output[node]
+            if found is not None and (best is None or found[1] > best[1]
+                                      or (found[1] == best[1] and found[0] < best[0])):
+                best = found
+        return None if best is None else self.rules[best[0]]
+
+def compile_rule_pack(path):
+    with open(path) as rule_file:
+        return CompiledRulePack(json.load(rule_file))
+
+# -----------------------------------------------------------------------------
+# Hot-Swappable Rule Pack
+# -----------------------------------------------------------------------------
+class RulePackManager:
+    """
+    Keeps the compiled rule pack for a file and recompiles it when the file
+    changes. The new automaton is swapped in as a whole, so requests in flight
+    keep using the one they started with. Also counts how often the rules
+    confirmed or overrode the model.
+    """
+
+    def __init__(self, path=RULE_PACK_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.compiled = None
+        self.mtime = None
+        self.last_check = 0.0
+        self.stats = {"checked": 0, "matched": 0, "confirmed": 0, "overridden": 0}
+        self.overrides = {}
+        self._reload()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            print(f"Rule pack {self.path} not available: {e}")
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            start = time.perf_counter()
+            compiled = compile_rule_pack(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            # Keep the previous rule pack if the new one is broken.
+            print(f"Could not compile rule pack {self.path}: {e}")
+            self.mtime = mtime
+            return
+        self.compiled = compiled
+        self.mtime = mtime
+        print(f"Loaded rule pack for {compiled.region}: {len(compiled.rules)} rules, "
+              f"{len(compiled.transitions)} nodes in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def current(self):
+        """The compiled rule pack, reloaded if the file changed."""
+        now = time.monotonic()
+        if now - self.last_check >= RELOAD_CHECK_SECONDS:
+            with self.lock:
+                if now - self.last_check >= RELOAD_CHECK_SECONDS:
+                    self.last_check = now
+                    self._reload()
+        return self.compiled
+
+    def check(self, waste_name, category):
+        """
+        Look the waste name up in the rule pack. Returns the matching rule
+        (item and category) or None, and counts confirmations and overrides.
+        """
+        compiled = self.current()
+        rule = compiled.match(waste_name) if compiled and waste_name else None
+        with self.lock:
+            self.stats["checked"] += 1
+            if rule is None:
+                return None
+            self.stats["matched"] += 1
+            if rule["category"] == category:
+                self.stats["confirmed"] += 1
+            else:
+                self.stats["overridden"] += 1
+                key = f"{category} -> {rule['category']} ({rule['item']})"
+                self.overrides[key] = self.overrides.get(key, 0) + 1
+        return rule
+
+    def report(self):
+        with self.lock:
+            checked = max(self.stats["checked"], 1)
+            return dict(self.stats,
+                        region=self.compiled.region if self.compiled else None,
+                        override_rate=self.stats["overridden"] / checked,
+                        overrides=dict(self.overrides))
+
+# -----------------------------------------------------------------------------
+# Benchmark
+# -----------------------------------------------------------------------------
+FILLER_WORDS = ["empty", "used", "old", "small", "large", "crushed", "dirty", "clear",
+                "white", "blue", "red", "plastic", "paper", "metal", "half", "broken"]
+
+def benchmark(path, names=10000):
+    """Time the matcher over generated waste names, like the ones the model returns."""
+    with open(path) as rule_file:
+        rule_pack = json.load(rule_file)
+    compiled = CompiledRulePack(rule_pack)
+    phrases = []
+    for rule in rule_pack["rules"]:
+        phrases.append(rule["item"])
+        phrases.extend(rule.get("aliases", []))
+    random.seed(1)
+    samples = []
+    for _ in range(names):
+        words = random.sample(FILLER_WORDS, random.randint(0, 2))
+        if random.random() < 0.8:
+            words.append(random.choice(phrases))
+        random.shuffle(words)
+        samples.append(" ".join(words) or "thing")
+
+    start = time.perf_counter()
+    matched = sum(1 for sample in samples if compiled.match(sample) is not None)
+    elapsed = time.perf_counter() - start
+    print(f"Rule pack {compiled.region}: {len(compiled.rules)} rules, {len(compiled.transitions)} automaton nodes")
+    print(f"Matched {matched} of {names} names in {elapsed * 1000:.1f} ms "
+          f"({elapsed / names * 1e6:.2f} us per name)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile, try and benchmark a waste rule pack.")
+    parser.add_argument("--pack", default=RULE_PACK_PATH, help="rule pack JSON file")
+    parser.add_argument("--benchmark", type=int, metavar="NAMES", help="benchmark over this many generated names")
+    parser.add_argument("names", nargs="*", help="waste names to look up")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.pack, args.benchmark)
+    compiled = compile_rule_pack(args.pack)
+    for name in args.names:
+        rule = compiled.match(name)
+        print(f"{name!r}: {rule['category'] + ' (' + rule['item'] + ')' if rule else 'no rule'}")
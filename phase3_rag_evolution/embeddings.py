@@ -0,0 +1,96 @@
+import http.client
+import json
+import re
+import zlib
+from urllib.parse import urlsplit
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# The same Ollama instance as phase 2, with an embedding model pulled next to
+# the vision model (ollama pull nomic-embed-text).
+OLLAMA_URL = "http://localhost:11434"
+EMBED_MODEL = "nomic-embed-text"
+EMBED_TIMEOUT = 10
+
+# Size of the vectors of the hashing embedder.
+HASHING_DIMENSIONS = 1024
+
+# Character n-grams used by the hashing embedder.
+HASHING_NGRAMS = (3, 4)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# -----------------------------------------------------------------------------
+# Embedders
+# -----------------------------------------------------------------------------
+def normalize_rows(vectors):
+    """L2-normalize every row so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+class OllamaEmbedder:
+    """Text embeddings from Ollama's /api/embed endpoint."""
+
+    def __init__(self, model=EMBED_MODEL, url=OLLAMA_URL, timeout=EMBED_TIMEOUT):
+        self.model = model
+        self.name = f"ollama:{model}"
+        self.url = urlsplit(url)
+        self.timeout = timeout
+
+    def embed(self, texts, timeout=None):
+        """Return an array with one normalized float32 row per text."""
+        connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80,
+                                                timeout=timeout or self.timeout)
+        try:
+            connection.request("POST", "/api/embed",
+                               body=json.dumps({"model": self.model, "input": list(texts)}),
+                               headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RuntimeError(f"Ollama returned HTTP {response.status}: {body[:200]!r}")
+            embeddings = json.loads(body)["embeddings"]
+        finally:
+            connection.close()
+        return normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+class HashingEmbedder:
+    """
+    Hashes character n-grams of each word into a fixed-size vector.
+
+    It knows nothing about meaning, but it catches spelling variants and word
+    fragments ("styrofoam" vs "foam", "batteries" vs "battery") and needs no
+    model, so retrieval can be tried and measured without Ollama running.
+    """
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing:{dimensions}"
+
+    def _features(self, text):
+        for word in WORD_PATTERN.findall(text.lower()):
+            marked = f"<{word}>"
+            yield marked
+            for size in HASHING_NGRAMS:
+                for start in range(len(marked) - size + 1):
+                    yield marked[start:start + size]
+
+    def embed(self, texts, timeout=None):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode())
+                # The top bit picks the sign so collisions tend to cancel out.
+                vectors[row, digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        return normalize_rows(vectors)
+
+def make_embedder(name, model=EMBED_MODEL):
+    """"ollama" or "hashing", as selected on the command line."""
+    if name == "ollama":
+        return OllamaEmbedder(model)
+    if name == "hashing":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown embedder '{name}'")
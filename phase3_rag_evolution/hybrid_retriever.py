@@ -0,0 +1,379 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+
+from embeddings import EMBED_MODEL, make_embedder
+
+# Item names are singularized like the phase 2 rule packs do it.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase2_connect_llm"))
+from rule_pack import normalize_token
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_BASE_PATH = os.path.join(BASE_DIR, "knowledge_base.json")
+EVAL_QUERIES_PATH = os.path.join(BASE_DIR, "eval_queries.json")
+
+# BM25 parameters (the usual defaults).
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Item names and aliases count this many times as much as words in the notes.
+NAME_FIELD_WEIGHT = 3
+
+# How many candidates each search hands to the fusion step.
+CANDIDATES = 20
+
+# Reciprocal rank fusion constant, score = sum of 1 / (RRF_K + rank).
+RRF_K = 60
+
+# Weight of the phrase overlap score added by the reranker. A full phrase match
+# is worth a bit more than being ranked first by one of the two searches.
+RERANK_WEIGHT = 0.02
+
+# Time a whole retrieval may take. Searches still running at the deadline are
+# left out of the fusion, and the reranker is skipped if it would not fit.
+LATENCY_BUDGET_MS = 200
+
+# Smoothing factor for the measured reranker time.
+EWMA_ALPHA = 0.2
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "go", "goes",
+             "has", "have", "in", "into", "is", "it", "its", "of", "off", "on", "or", "that",
+             "the", "them", "they", "this", "to", "too", "with"}
+
+# -----------------------------------------------------------------------------
+# Text Processing
+# -----------------------------------------------------------------------------
+def tokenize(text):
+    """Lowercase words without stopwords, singularized."""
+    return [normalize_token(word) for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+
+def load_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    with open(path) as kb_file:
+        return json.load(kb_file)["items"]
+
+def item_phrases(item):
+    """The item name followed by its aliases."""
+    return [item["item"]] + item.get("aliases", [])
+
+# -----------------------------------------------------------------------------
+# BM25 Inverted Index
+# -----------------------------------------------------------------------------
+class BM25Index:
+    """
+    An inverted index from each term to the documents containing it.
+
+    The BM25 weight of every (term, document) pair only depends on the
+    document, so it is computed once when the index is built. A query then
+    only adds up the stored weights of its terms' posting lists.
+    """
+
+    def __init__(self, documents):
+        """documents is a list of token lists, one per knowledge base item."""
+        self.document_count = len(documents)
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)
+        average_length = max(float(lengths.mean()), 1.0) if len(documents) else 1.0
+
+        term_counts = {}
+        for doc, tokens in enumerate(documents):
+            for term in tokens:
+                counts = term_counts.setdefault(term, {})
+                counts[doc] = counts.get(doc, 0) + 1
+
+        self.postings = {}
+        for term, counts in term_counts.items():
+            doc_ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            frequencies = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            idf = np.log(1 + (self.document_count - len(counts) + 0.5) / (len(counts) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_ids] / average_length)
+            weights = idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+            self.postings[term] = (doc_ids, weights.astype(np.float32))
+
+    def search(self, tokens, limit=CANDIDATES):
+        """Return up to limit (document, score) pairs, best first."""
+        scores = np.zeros(self.document_count, dtype=np.float32)
+        for term in set(tokens):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return top_documents(scores, limit)
+
+def top_documents(scores, limit):
+    """The (document, score) pairs with the highest positive scores, best first."""
+    limit = min(limit, len(scores))
+    if limit == 0:
+        return []
+    candidates = np.argpartition(-scores, limit - 1)[:limit]
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [(int(doc), float(scores[doc])) for doc in candidates if scores[doc] > 0]
+
+# -----------------------------------------------------------------------------
+# Vector Index
+# -----------------------------------------------------------------------------
+class VectorIndex:
+    """
+    Embeddings of every item name and alias. A document scores the best cosine
+    similarity of any of its phrases, so a short alias like "tetra pak" is not
+    diluted by the rest of the item.
+    """
+
+    def __init__(self, embedder, phrases, phrase_docs, document_count, matrix=None):
+        """matrix can hold precomputed (e.g. cached) embeddings of the phrases."""
+        self.embedder = embedder
+        self.phrase_docs = np.asarray(phrase_docs, dtype=np.int32)
+        self.document_count = document_count
+        self.matrix = embedder.embed(phrases) if matrix is None else matrix
+        # Phrases grouped by document, so the best phrase of every document is
+        # one maximum.reduceat (every document has at least its item name).
+        self.phrase_order = np.argsort(self.phrase_docs, kind="stable")
+        self.doc_starts = np.searchsorted(self.phrase_docs[self.phrase_order], np.arange(document_count))
+
+    def similarities(self, query_vector):
+        """Cosine similarity of the query with every phrase."""
+        return self.matrix @ query_vector
+
+    def memory_bytes(self):
+        return self.matrix.nbytes
+
+    def search_vector(self, query_vector, limit=CANDIDATES):
+        similarities = self.similarities(query_vector)
+        scores = np.maximum.reduceat(similarities[self.phrase_order], self.doc_starts)
+        # Cosine similarity can be negative, shift it so top_documents keeps every candidate.
+        return [(doc, score - 1.0) for doc, score in top_documents(scores + 1.0, limit)]
+
+    def search(self, query, limit=CANDIDATES, timeout=None):
+        return self.search_vector(self.embedder.embed([query], timeout=timeout)[0], limit)
+
+# -----------------------------------------------------------------------------
+# Fusion and Reranking
+# -----------------------------------------------------------------------------
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked document lists into one list of (document, score), best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc] = scores.get(doc, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+def phrase_overlap(query_tokens, phrase_tokens):
+    """
+    Share of a phrase's tokens that appear in the query, as 0.0 - 1.0. A phrase
+    that appears in the query word for word gets the full score.
+    """
+    if not phrase_tokens or not query_tokens:
+        return 0.0
+    length = len(phrase_tokens)
+    for start in range(len(query_tokens) - length + 1):
+        if query_tokens[start:start + length] == phrase_tokens:
+            return 1.0
+    query_set = set(query_tokens)
+    # Scattered matches are worth less than the phrase in one piece.
+    return 0.8 * sum(1 for token in phrase_tokens if token in query_set) / length
+
+# -----------------------------------------------------------------------------
+# Hybrid Retriever
+# -----------------------------------------------------------------------------
+class HybridRetriever:
+    """
+    Runs the BM25 and vector searches at the same time, fuses their rankings
+    with reciprocal rank fusion and optionally reranks the fused candidates
+    by how well an item's name or aliases match the query.
+
+    Every query has a latency budget. A search that has not finished by then
+    is left out (the other one still answers), and the reranker only runs if
+    its usual time fits into what is left.
+    """
+
+    def __init__(self, items, embedder=None, budget_ms=LATENCY_BUDGET_MS, index="float32", exact_path=None):
+        """index and exact_path select the vector index, see quantized_index.make_index."""
+        self.items = items
+        self.budget_ms = budget_ms
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+        self.rerank_ms = 0.1
+
+        documents = []
+        phrases = []
+        phrase_docs = []
+        self.phrase_tokens = []
+        for doc, item in enumerate(items):
+            names = item_phrases(item)
+            tokens = []
+            for phrase in names:
+                tokens.extend(tokenize(phrase) * NAME_FIELD_WEIGHT)
+            tokens.extend(tokenize(item.get("notes", "")))
+            documents.append(tokens)
+            phrases.extend(names)
+            phrase_docs.extend([doc] * len(names))
+            self.phrase_tokens.append([tokenize(phrase) for phrase in names])
+
+        start = time.perf_counter()
+        self.bm25 = BM25Index(documents)
+        self.build_ms = {"bm25": (time.perf_counter() - start) * 1000}
+        self.vectors = None
+        if embedder is not None:
+            start = time.perf_counter()
+            try:
+                if index == "float32":
+                    self.vectors = VectorIndex(embedder, phrases, phrase_docs, len(items))
+                else:
+                    # Imported here because quantized_index builds on this module.
+                    from quantized_index import make_index
+                    self.vectors = make_index(index, embedder, phrases, phrase_docs, len(items),
+                                              exact_path=exact_path)
+                self.build_ms["vector"] = (time.perf_counter() - start) * 1000
+            except (OSError, RuntimeError, ValueError, KeyError) as e:
+                print(f"Could not build the vector index with {embedder.name}, using BM25 only: {e}")
+
+    def _timed(self, function, *args):
+        start = time.perf_counter()
+        hits = function(*args)
+        return hits, (time.perf_counter() - start) * 1000
+
+    def rerank(self, query_tokens, fused):
+        reranked = []
+        for doc, score in fused:
+            best = max(phrase_overlap(query_tokens, tokens) for tokens in self.phrase_tokens[doc])
+            reranked.append((doc, score + RERANK_WEIGHT * best))
+        reranked.sort(key=lambda pair: pair[1], reverse=True)
+        return reranked
+
+    def search(self, query, k=5, use_bm25=True, use_vector=True, rerank=True, budget_ms=None):
+        """
+        Return (results, info). results are the top k knowledge base items with
+        a "score", info has the time of every stage and the stages that were
+        cut off by the budget or failed.
+        """
+        start = time.perf_counter()
+        budget = (self.budget_ms if budget_ms is None else budget_ms) / 1000
+        deadline = start + budget
+        query_tokens = tokenize(query)
+        info = {"cut_off": [], "failed": []}
+
+        futures = {}
+        if use_bm25:
+            futures["bm25"] = self.executor.submit(self._timed, self.bm25.search, query_tokens, CANDIDATES)
+        if use_vector and self.vectors is not None:
+            futures["vector"] = self.executor.submit(self._timed, self.vectors.search, query,
+                                                     CANDIDATES, budget)
+        done, _ = wait(futures.values(), timeout=max(deadline - time.perf_counter(), 0))
+
+        rankings = []
+        for name, future in futures.items():
+            if future not in done:
+                # The thread keeps running until the call returns, but its
+                # answer is no longer waited for.
+                future.cancel()
+                info["cut_off"].append(name)
+            elif future.exception() is not None:
+                info["failed"].append(f"{name}: {future.exception()}")
+            else:
+                hits, elapsed_ms = future.result()
+                info[f"{name}_ms"] = elapsed_ms
+                rankings.append([doc for doc, _ in hits])
+        fused = reciprocal_rank_fusion(rankings)
+
+        if rerank and fused:
+            remaining_ms = (deadline - time.perf_counter()) * 1000
+            if remaining_ms >= self.rerank_ms:
+                rerank_start = time.perf_counter()
+                fused = self.rerank(query_tokens, fused)
+                elapsed_ms = (time.perf_counter() - rerank_start) * 1000
+                self.rerank_ms += EWMA_ALPHA * (elapsed_ms - self.rerank_ms)
+                info["rerank_ms"] = elapsed_ms
+            else:
+                info["cut_off"].append("rerank")
+
+        info["total_ms"] = (time.perf_counter() - start) * 1000
+        results = [dict(self.items[doc], score=score) for doc, score in fused[:k]]
+        return results, info
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# -----------------------------------------------------------------------------
+# Evaluation
+# -----------------------------------------------------------------------------
+EVAL_CONFIGS = {
+    "bm25": {"use_vector": False, "rerank": False},
+    "vector": {"use_bm25": False, "rerank": False},
+    "hybrid": {"rerank": False},
+    "hybrid+rerank": {"rerank": True},
+}
+
+def percentile(values, percent):
+    return float(np.percentile(values, percent)) if values else 0.0
+
+def evaluate(retriever, queries, k=5, configs=EVAL_CONFIGS):
+    """Print recall@1, recall@k and latency of every configuration over the labelled queries."""
+    # One untimed query so first-call costs (thread start, connection) are not measured.
+    retriever.search(queries[0]["query"], k)
+    print(f"{'config':<15}{'recall@1':>10}{'recall@' + str(k):>10}{'p50 ms':>10}{'p95 ms':>10}{'cut off':>9}")
+    report = {}
+    for name, options in configs.items():
+        if retriever.vectors is None and not options.get("use_bm25", True):
+            continue
+        top1 = topk = cut_off = 0
+        latencies = []
+        misses = []
+        for query in queries:
+            results, info = retriever.search(query["query"], k, **options)
+            ids = [result["id"] for result in results]
+            latencies.append(info["total_ms"])
+            cut_off += bool(info["cut_off"])
+            if ids[:1] == [query["expected"]]:
+                top1 += 1
+            if query["expected"] in ids:
+                topk += 1
+            else:
+                misses.append(query["query"])
+        count = len(queries)
+        report[name] = {"recall@1": top1 / count, f"recall@{k}": topk / count,
+                        "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+                        "cut_off": cut_off, "misses": misses}
+        print(f"{name:<15}{top1 / count:>10.2f}{topk / count:>10.2f}"
+              f"{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}{cut_off:>9}")
+    for name, row in report.items():
+        if row["misses"]:
+            print(f"Missed by {name}: {', '.join(row['misses'])}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the waste knowledge base and measure recall and latency.")
+    parser.add_argument("--kb", default=KNOWLEDGE_BASE_PATH, help="knowledge base JSON file")
+    parser.add_argument("--queries", default=EVAL_QUERIES_PATH, help="labelled queries JSON file")
+    parser.add_argument("--embedder", choices=("ollama", "hashing", "none"), default="ollama")
+    parser.add_argument("--embed-model", default=EMBED_MODEL, help="Ollama embedding model")
+    parser.add_argument("--k", type=int, default=5, help="number of items to retrieve")
+    parser.add_argument("--budget-ms", type=float, default=LATENCY_BUDGET_MS, help="latency budget per query")
+    parser.add_argument("--index", choices=("float32", "int8", "pq"), default="float32",
+                        help="vector index, int8 and pq are compressed (see quantized_index.py)")
+    parser.add_argument("--exact-vectors", metavar="NPY",
+                        help="write the float32 vectors here and rerank the compressed index exactly from it")
+    parser.add_argument("--eval", action="store_true", help="evaluate against the labelled queries")
+    parser.add_argument("query", nargs="*", help="item names to search for")
+    args = parser.parse_args()
+
+    embedder = None if args.embedder == "none" else make_embedder(args.embedder, args.embed_model)
+    retriever = HybridRetriever(load_knowledge_base(args.kb), embedder, args.budget_ms,
+                                args.index, args.exact_vectors)
+    print(f"Indexed {len(retriever.items)} items in "
+          + ", ".join(f"{name} {ms:.1f} ms" for name, ms in retriever.build_ms.items()))
+
+    if args.eval:
+        with open(args.queries) as queries_file:
+            evaluate(retriever, json.load(queries_file), args.k)
+    for query in args.query:
+        results, info = retriever.search(query, args.k)
+        print(f"{query!r} ({info['total_ms']:.1f} ms{', cut off: ' + ', '.join(info['cut_off']) if info['cut_off'] else ''})")
+        for result in results:
+            print(f"  {result['score']:.4f}  {result['item']} ({result['category']})")
+    retriever.close()
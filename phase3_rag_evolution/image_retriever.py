@@ -0,0 +1,267 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+from embeddings import EMBED_MODEL, make_embedder, normalize_rows
+from hybrid_retriever import BASE_DIR, HybridRetriever, item_phrases, load_knowledge_base, percentile
+from quantized_index import INDEX_TYPES, make_index
+
+# The phase 2 server code does the Ollama calls and parsing.
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "phase2_connect_llm"))
+import llm_processor
+
+try:
+    import open_clip
+    import torch
+except ImportError:
+    open_clip = None
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# A small CLIP model that runs on the CPU in well under a second.
+CLIP_MODEL = "ViT-B-32"
+CLIP_PRETRAINED = "laion2b_s34b_b79k"
+
+# CLIP matches images best against captions rather than bare item names.
+CLIP_TEXT_TEMPLATE = "a photo of {}, household waste"
+
+# The text embeddings of the knowledge base are computed once per model and
+# knowledge base content, and loaded from here afterwards.
+EMBEDDING_CACHE_DIR = os.path.join(BASE_DIR, "embedding_cache")
+
+# Knowledge base items put into the prompt.
+RETRIEVED_ITEMS = 3
+
+# Every comparison run is appended here, so retrieval accuracy can be followed
+# as the knowledge base and models change.
+RUN_LOG = os.path.join(BASE_DIR, "retrieval_runs.jsonl")
+
+RAG_PROMPT = (
+    llm_processor.CONSTRAINED_PROMPT
+    + " Follow these local council rules if one of them is about the item:\n{rules}"
+)
+
+# -----------------------------------------------------------------------------
+# Image-Text Embeddings
+# -----------------------------------------------------------------------------
+class ClipEmbedder:
+    """Image and text embeddings in the same space from an open_clip model, on the CPU."""
+
+    def __init__(self, model_name=CLIP_MODEL, pretrained=CLIP_PRETRAINED):
+        if open_clip is None:
+            raise RuntimeError("Image retrieval needs open_clip and torch (pip install open_clip_torch)")
+        self.model, _, self.preprocess = open_clip.create_model_and_transforms(
+            model_name, pretrained=pretrained, device="cpu")
+        self.model.eval()
+        self.tokenizer = open_clip.get_tokenizer(model_name)
+        self.name = f"clip:{model_name}:{pretrained}"
+
+    def embed(self, texts, timeout=None):
+        tokens = self.tokenizer([CLIP_TEXT_TEMPLATE.format(text) for text in texts])
+        with torch.no_grad():
+            features = self.model.encode_text(tokens)
+        return normalize_rows(features.float().numpy())
+
+    def embed_image(self, image):
+        pixels = self.preprocess(image.convert("RGB")).unsqueeze(0)
+        with torch.no_grad():
+            features = self.model.encode_image(pixels)
+        return normalize_rows(features.float().numpy())[0]
+
+def cached_text_embeddings(embedder, phrases):
+    """Embeddings of the phrases, from the cache if this model already embedded them."""
+    # The CLIP caption template changes the embeddings as much as the model does.
+    key = hashlib.sha1("\n".join([embedder.name, CLIP_TEXT_TEMPLATE] + phrases).encode()).hexdigest()[:16]
+    path = os.path.join(EMBEDDING_CACHE_DIR, f"kb_text_{key}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+    matrix = embedder.embed(phrases)
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+    np.save(path, matrix)
+    return matrix
+
+class ImageRetriever:
+    """
+    Finds knowledge base items straight from the captured image by comparing
+    its CLIP embedding with the text embeddings of every item name and alias.
+    """
+
+    def __init__(self, items, embedder, index="float32", exact_path=None):
+        """index and exact_path select the vector index, see quantized_index.make_index."""
+        self.items = items
+        self.embedder = embedder
+        phrases = []
+        phrase_docs = []
+        for doc, item in enumerate(items):
+            names = item_phrases(item)
+            phrases.extend(names)
+            phrase_docs.extend([doc] * len(names))
+        start = time.perf_counter()
+        matrix = cached_text_embeddings(embedder, phrases)
+        self.load_ms = (time.perf_counter() - start) * 1000
+        self.index = make_index(index, embedder, phrases, phrase_docs, len(items), matrix, exact_path)
+
+    def search(self, image, k=RETRIEVED_ITEMS):
+        """Return (items, timings) for a PIL image."""
+        start = time.perf_counter()
+        vector = self.embedder.embed_image(image)
+        embedded = time.perf_counter()
+        hits = self.index.search_vector(vector, k)
+        timings = {"embed_ms": (embedded - start) * 1000,
+                   "search_ms": (time.perf_counter() - embedded) * 1000}
+        return [dict(self.items[doc], score=score) for doc, score in hits], timings
+
+# -----------------------------------------------------------------------------
+# Classification Flows
+# -----------------------------------------------------------------------------
+def format_rules(items):
+    return "\n".join(f"- {item['item']} ({', '.join(item.get('aliases', [])[:4])}): "
+                     f"{item['category']}. {item['notes']}" for item in items)
+
+def classify_with_rules(image_b64, items):
+    """The single classification call with the retrieved rules in the prompt."""
+    content, stats = llm_processor.call_ollama(
+        RAG_PROMPT.format(rules=format_rules(items)), image_b64,
+        response_format=llm_processor.CLASSIFICATION_SCHEMA,
+        max_tokens=llm_processor.MAX_CONSTRAINED_TOKENS)
+    result, _ = llm_processor.parse_response(content)
+    llm_processor.apply_rule_pack(result)
+    return result, stats
+
+def single_pass(image_path, image_retriever, k=RETRIEVED_ITEMS):
+    """Embed the image, retrieve the rules and classify: one model generation."""
+    start = time.perf_counter()
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    with Image.open(image_path) as image:
+        items, timings = image_retriever.search(image, k)
+    retrieved = time.perf_counter()
+    result, stats = classify_with_rules(base64.b64encode(image_bytes).decode("ascii"), items)
+    timings.update(retrieval_ms=(retrieved - start) * 1000, llm_ms=stats["total_ms"],
+                   total_ms=(time.perf_counter() - start) * 1000, generations=1)
+    return result, items, timings
+
+def two_pass(image_path, text_retriever, k=RETRIEVED_ITEMS):
+    """Let the model name the item, retrieve the rules by that name and classify again."""
+    start = time.perf_counter()
+    with open(image_path, "rb") as image_file:
+        image_b64 = base64.b64encode(image_file.read()).decode("ascii")
+    content, describe_stats = llm_processor.call_ollama(
+        llm_processor.CONSTRAINED_PROMPT, image_b64,
+        response_format=llm_processor.CLASSIFICATION_SCHEMA,
+        max_tokens=llm_processor.MAX_CONSTRAINED_TOKENS)
+    description, _ = llm_processor.parse_response(content)
+    described = time.perf_counter()
+    items, _ = text_retriever.search(description["waste_name"], k)
+    retrieved = time.perf_counter()
+    result, stats = classify_with_rules(image_b64, items)
+    timings = {"describe_ms": (described - start) * 1000,
+               "retrieval_ms": (retrieved - described) * 1000,
+               "llm_ms": describe_stats["total_ms"] + stats["total_ms"],
+               "total_ms": (time.perf_counter() - start) * 1000, "generations": 2}
+    return result, items, timings
+
+# -----------------------------------------------------------------------------
+# Comparison
+# -----------------------------------------------------------------------------
+def summarize(rows, k):
+    count = max(len(rows), 1)
+    totals = [row["total_ms"] for row in rows]
+    return {
+        "images": len(rows),
+        "retrieval_recall@1": sum(row["rank"] == 1 for row in rows) / count,
+        f"retrieval_recall@{k}": sum(row["rank"] is not None for row in rows) / count,
+        "category_accuracy": sum(row["correct"] for row in rows) / count if "correct" in rows[0] else None,
+        "p50_ms": percentile(totals, 50),
+        "p95_ms": percentile(totals, 95),
+        "avg_llm_ms": sum(row["llm_ms"] for row in rows) / count,
+        "avg_retrieval_ms": sum(row["retrieval_ms"] for row in rows) / count,
+    }
+
+def compare_flows(labelled, items, image_retriever, text_retriever, k=RETRIEVED_ITEMS, retrieve_only=False):
+    """
+    Run the labelled images ({"image", "expected"} with a knowledge base item
+    id) through both flows, or only through the image retrieval.
+    """
+    categories = {item["id"]: item["category"] for item in items}
+    flows = {"image_embedding": []} if retrieve_only else {"single_pass": [], "two_pass": []}
+    for entry in labelled:
+        expected = entry["expected"]
+        for flow, rows in flows.items():
+            if flow == "image_embedding":
+                with Image.open(entry["image"]) as image:
+                    retrieved, timings = image_retriever.search(image, k)
+                timings.update(retrieval_ms=timings["embed_ms"] + timings["search_ms"], llm_ms=0.0)
+                timings["total_ms"] = timings["retrieval_ms"]
+                result = None
+            elif flow == "single_pass":
+                result, retrieved, timings = single_pass(entry["image"], image_retriever, k)
+            else:
+                result, retrieved, timings = two_pass(entry["image"], text_retriever, k)
+            ids = [item["id"] for item in retrieved]
+            row = dict(timings, image=entry["image"],
+                       rank=ids.index(expected) + 1 if expected in ids else None)
+            if result is not None:
+                row["correct"] = result["waste_category"] == categories[expected]
+            rows.append(row)
+            print(f"[{flow}] {os.path.basename(entry['image'])}: retrieved {', '.join(ids)} "
+                  f"(expected {expected}), {timings['total_ms']:.0f} ms"
+                  + (f", {result['waste_category']}" if result is not None else ""))
+
+    report = {flow: summarize(rows, k) for flow, rows in flows.items() if rows}
+    print(f"{'flow':<17}{'recall@1':>10}{'recall@' + str(k):>10}{'accuracy':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for flow, summary in report.items():
+        accuracy = summary["category_accuracy"]
+        print(f"{flow:<17}{summary['retrieval_recall@1']:>10.2f}{summary[f'retrieval_recall@{k}']:>10.2f}"
+              f"{'-' if accuracy is None else f'{accuracy:.2f}':>10}"
+              f"{summary['p50_ms']:>10.0f}{summary['p95_ms']:>10.0f}")
+    with open(RUN_LOG, "a") as log_file:
+        log_file.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "clip": image_retriever.embedder.name,
+                                   "k": k, "report": report}) + "\n")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieve knowledge base rules straight from an image.")
+    parser.add_argument("--compare", metavar="LABELLED_JSON",
+                        help='JSON list of {"image": path, "expected": item id} to compare both flows on')
+    parser.add_argument("--retrieve-only", action="store_true",
+                        help="only measure the image retrieval, without calling the vision model")
+    parser.add_argument("--k", type=int, default=RETRIEVED_ITEMS, help="number of items to retrieve")
+    parser.add_argument("--text-embedder", choices=("ollama", "hashing", "none"), default="ollama",
+                        help="embedder of the text retriever used by the two-pass flow")
+    parser.add_argument("--index", choices=INDEX_TYPES, default="float32",
+                        help="vector index of both retrievers, int8 and pq are compressed (see quantized_index.py)")
+    parser.add_argument("--exact-vectors", metavar="NPY",
+                        help="write the float32 image retriever vectors here and rerank the compressed index "
+                             "exactly from it")
+    parser.add_argument("images", nargs="*", help="images to retrieve rules for")
+    args = parser.parse_args()
+
+    items = load_knowledge_base()
+    image_retriever = ImageRetriever(items, ClipEmbedder(), args.index, args.exact_vectors)
+    print(f"Loaded {len(items)} item embeddings with {image_retriever.embedder.name} "
+          f"in {image_retriever.load_ms:.0f} ms")
+
+    if args.compare:
+        with open(args.compare) as labelled_file:
+            labelled = json.load(labelled_file)
+        text_retriever = None
+        if not args.retrieve_only:
+            embedder = None if args.text_embedder == "none" else make_embedder(args.text_embedder, EMBED_MODEL)
+            text_retriever = HybridRetriever(items, embedder, index=args.index)
+        compare_flows(labelled, items, image_retriever, text_retriever, args.k, args.retrieve_only)
+        if text_retriever is not None:
+            text_retriever.close()
+    for path in args.images:
+        with Image.open(path) as image:
+            retrieved, timings = image_retriever.search(image, args.k)
+        print(f"{path}: embedded in {timings['embed_ms']:.0f} ms")
+        for item in retrieved:
+            print(f"  {item['score']:.3f}  {item['item']} ({item['category']})")
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+from embeddings import EMBED_MODEL, make_embedder, normalize_rows
+from hybrid_retriever import EVAL_QUERIES_PATH, VectorIndex, item_phrases, load_knowledge_base
+
+# -----------------------------------------------------------------------------
+# Global Variables and Configuration
+# -----------------------------------------------------------------------------
+# Product quantization splits every vector into this many sub-vectors and
+# stores one byte (a centroid number) per sub-vector. Must divide the
+# embedding size (768 for nomic-embed-text, 512 for CLIP ViT-B-32).
+PQ_SUBSPACES = 16
+
+# Centroids per sub-vector, at most 256 so a code fits in one byte.
+PQ_CENTROIDS = 256
+
+# k-means iterations and the number of vectors used to train the codebooks.
+PQ_TRAIN_ITERATIONS = 15
+PQ_TRAIN_SAMPLES = 20000
+
+# Phrases whose approximate score is recomputed with the float32 vectors when
+# exact reranking is enabled.
+RERANK_CANDIDATES = 64
+
+# Rows of int8 codes converted to float32 at a time, so a search never needs
+# a float32 copy of the whole index (512 x 1024 dimensions is 2 MB).
+INT8_BLOCK_ROWS = 512
+
+# Minimum time each index is timed for in the report.
+BENCHMARK_SECONDS = 0.5
+
+# Vector indexes the retrievers can be built with (see make_index).
+INDEX_TYPES = ("float32", "int8", "pq")
+
+# -----------------------------------------------------------------------------
+# Quantized Indexes
+# -----------------------------------------------------------------------------
+class QuantizedIndex(VectorIndex):
+    """
+    A VectorIndex that keeps compressed codes instead of the float32 matrix.
+    Subclasses implement encode(vectors) and approximate_similarities(query).
+
+    The query itself stays float32 (asymmetric distance computation), only the
+    stored vectors are approximated. With exact_vectors (e.g. a memory-mapped
+    .npy of the float32 matrix) the best RERANK_CANDIDATES phrases are scored
+    again exactly, and only those rows are read from the file.
+    """
+
+    def __init__(self, embedder, phrases, phrase_docs, document_count, matrix=None,
+                 exact_vectors=None, rerank=RERANK_CANDIDATES):
+        super().__init__(embedder, phrases, phrase_docs, document_count, matrix)
+        vectors = np.asarray(self.matrix, dtype=np.float32)
+        self.matrix = None
+        self.exact_vectors = exact_vectors
+        self.rerank = rerank if exact_vectors is not None else 0
+        self.encode(vectors)
+
+    def similarities(self, query_vector):
+        approximate = self.approximate_similarities(query_vector)
+        if not self.rerank:
+            return approximate
+        count = min(self.rerank, len(approximate))
+        # Sorted row numbers read the memory-mapped file front to back.
+        candidates = np.sort(np.argpartition(-approximate, count - 1)[:count])
+        # The other phrases keep their approximate score, they can only fill
+        # up the ranking behind the candidates.
+        approximate[candidates] = np.asarray(self.exact_vectors[candidates]) @ query_vector
+        return approximate
+
+class Int8Index(QuantizedIndex):
+    """Scalar quantization: every dimension scaled to -127..127 and stored as int8."""
+
+    def encode(self, vectors):
+        scale = np.abs(vectors).max(axis=0) / 127
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        self.codes = np.round(vectors / self.scale).astype(np.int8)
+
+    def approximate_similarities(self, query_vector):
+        # Folding the scale into the query keeps the codes untouched. numpy has
+        # no int8 x float32 product, so the codes are converted to float32 a
+        # block at a time, which only bounds the temporary memory. The gain of
+        # int8 is memory, it is still slower than the float32 index.
+        scaled_query = query_vector * self.scale
+        similarities = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), INT8_BLOCK_ROWS):
+            block = self.codes[start:start + INT8_BLOCK_ROWS]
+            similarities[start:start + INT8_BLOCK_ROWS] = block.astype(np.float32) @ scaled_query
+        return similarities
+
+    def memory_bytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+class PQIndex(QuantizedIndex):
+    """
+    Product quantization: every sub-vector is replaced by the number of its
+    nearest centroid. A query builds one lookup table of its dot product with
+    every centroid, and a phrase's score is the sum of its table entries.
+    """
+
+    def encode(self, vectors):
+        count, dimensions = vectors.shape
+        if dimensions % PQ_SUBSPACES:
+            raise ValueError(f"{dimensions} dimensions cannot be split into {PQ_SUBSPACES} sub-vectors")
+        self.sub_dimensions = dimensions // PQ_SUBSPACES
+        centroids = min(PQ_CENTROIDS, count)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(count, min(count, PQ_TRAIN_SAMPLES), replace=False)]
+
+        self.codebooks = np.empty((PQ_SUBSPACES, centroids, self.sub_dimensions), dtype=np.float32)
+        self.codes = np.empty((count, PQ_SUBSPACES), dtype=np.uint8)
+        for subspace in range(PQ_SUBSPACES):
+            columns = slice(subspace * self.sub_dimensions, (subspace + 1) * self.sub_dimensions)
+            codebook = train_codebook(sample[:, columns], centroids, rng)
+            self.codebooks[subspace] = codebook
+            self.codes[:, subspace] = nearest_centroids(vectors[:, columns], codebook)
+        # Offsets into the flattened lookup table, one row of centroids per sub-vector.
+        self.offsets = (np.arange(PQ_SUBSPACES) * centroids).astype(np.intp)
+
+    def approximate_similarities(self, query_vector):
+        sub_queries = query_vector.reshape(PQ_SUBSPACES, self.sub_dimensions)
+        table = np.einsum("scd,sd->sc", self.codebooks, sub_queries)
+        return table.ravel()[self.codes + self.offsets].sum(axis=1)
+
+    def memory_bytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+def make_index(kind, embedder, phrases, phrase_docs, document_count, matrix=None,
+               exact_path=None, rerank=RERANK_CANDIDATES):
+    """
+    A vector index of one of INDEX_TYPES, as selected on the command line.
+    With exact_path the float32 vectors are written to that .npy file and
+    memory-mapped for exact reranking of the compressed indexes (the float32
+    index is exact already and ignores it).
+    """
+    if kind == "float32":
+        return VectorIndex(embedder, phrases, phrase_docs, document_count, matrix)
+    index_classes = {"int8": Int8Index, "pq": PQIndex}
+    if kind not in index_classes:
+        raise ValueError(f"Unknown index '{kind}'")
+    if matrix is None:
+        matrix = embedder.embed(phrases)
+    exact_vectors = None
+    if exact_path:
+        # Written on every build, so the file always matches these phrases.
+        np.save(exact_path, np.asarray(matrix, dtype=np.float32))
+        exact_vectors = np.load(exact_path, mmap_mode="r")
+    return index_classes[kind](embedder, phrases, phrase_docs, document_count, matrix, exact_vectors, rerank)
+
+def nearest_centroids(vectors, codebook):
+    distances = ((codebook ** 2).sum(axis=1)[None, :] - 2 * vectors @ codebook.T)
+    return distances.argmin(axis=1)
+
+def train_codebook(vectors, centroids, rng):
+    """Plain k-means, empty clusters keep their previous centroid."""
+    codebook = vectors[rng.choice(len(vectors), centroids, replace=False)].copy()
+    for _ in range(PQ_TRAIN_ITERATIONS):
+        assignment = nearest_centroids(vectors, codebook)
+        counts = np.bincount(assignment, minlength=centroids)
+        sums = np.zeros_like(codebook)
+        np.add.at(sums, assignment, vectors)
+        filled = counts > 0
+        codebook[filled] = sums[filled] / counts[filled, None]
+    return codebook
+
+# -----------------------------------------------------------------------------
+# Report
+# -----------------------------------------------------------------------------
+def queries_per_second(index, query_vectors, limit):
+    searches = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < BENCHMARK_SECONDS:
+        for query_vector in query_vectors:
+            index.search_vector(query_vector, limit)
+        searches += len(query_vectors)
+    return searches / (time.perf_counter() - start)
+
+def top_phrases(similarities, k):
+    return set(np.argpartition(-similarities, k - 1)[:k].tolist())
+
+def compare_indexes(embedder, items, queries, k=10, synthetic=0, rerank=RERANK_CANDIDATES):
+    """
+    Print memory, queries per second and recall of every index type. The
+    neighbour recall is the share of the uncompressed index's top k phrases
+    that an index also returns, the item recall uses the labelled queries.
+    With synthetic > 0 that many noisy copies of the phrases are added, to see
+    how the indexes behave with a knowledge base of realistic size.
+    """
+    phrases = []
+    phrase_docs = []
+    for doc, item in enumerate(items):
+        names = item_phrases(item)
+        phrases.extend(names)
+        phrase_docs.extend([doc] * len(names))
+    matrix = embedder.embed(phrases)
+    query_vectors = embedder.embed([query["query"] for query in queries])
+    expected = [next(doc for doc, item in enumerate(items) if item["id"] == query["expected"])
+                for query in queries]
+
+    if synthetic:
+        rng = np.random.default_rng(1)
+        sources = rng.integers(0, len(phrases), synthetic)
+        noise = rng.normal(0, 0.5 / np.sqrt(matrix.shape[1]), (synthetic, matrix.shape[1]))
+        matrix = np.vstack([matrix, normalize_rows(matrix[sources] + noise)])
+        phrase_docs = phrase_docs + [phrase_docs[source] for source in sources]
+        phrases = phrases + [phrases[source] for source in sources]
+
+    # The float32 vectors for reranking are read from disk through a memory map.
+    exact_file = tempfile.NamedTemporaryFile(suffix=".npy", delete=False)
+    exact_file.close()
+    np.save(exact_file.name, matrix)
+    exact_vectors = np.load(exact_file.name, mmap_mode="r")
+
+    builders = {
+        "float32": lambda: VectorIndex(embedder, phrases, phrase_docs, len(items), matrix),
+        "int8": lambda: Int8Index(embedder, phrases, phrase_docs, len(items), matrix),
+        "int8+rerank": lambda: Int8Index(embedder, phrases, phrase_docs, len(items), matrix, exact_vectors, rerank),
+        "pq": lambda: PQIndex(embedder, phrases, phrase_docs, len(items), matrix),
+        "pq+rerank": lambda: PQIndex(embedder, phrases, phrase_docs, len(items), matrix, exact_vectors, rerank),
+    }
+    print(f"{len(phrases)} vectors of {matrix.shape[1]} dimensions from {embedder.name}, "
+          f"{len(queries)} queries, rerank of {rerank} candidates")
+    print(f"{'index':<13}{'memory KB':>11}{'build ms':>10}{'QPS':>10}"
+          f"{'recall@' + str(k):>11}{'item@1':>8}{'item@5':>8}")
+
+    reference = [top_phrases(matrix @ query_vector, k) for query_vector in query_vectors]
+    report = {}
+    try:
+        for name, build in builders.items():
+            start = time.perf_counter()
+            index = build()
+            build_ms = (time.perf_counter() - start) * 1000
+            neighbour_recall = np.mean([len(top_phrases(index.similarities(query_vector), k) & exact) / k
+                                        for query_vector, exact in zip(query_vectors, reference)])
+            ranked = [[doc for doc, _ in index.search_vector(query_vector, 5)] for query_vector in query_vectors]
+            item_top1 = np.mean([docs[:1] == [doc] for docs, doc in zip(ranked, expected)])
+            item_top5 = np.mean([doc in docs for docs, doc in zip(ranked, expected)])
+            qps = queries_per_second(index, query_vectors, 5)
+            report[name] = {"memory_bytes": index.memory_bytes(), "build_ms": build_ms, "qps": qps,
+                            f"recall@{k}": float(neighbour_recall), "item_recall@1": float(item_top1),
+                            "item_recall@5": float(item_top5)}
+            print(f"{name:<13}{index.memory_bytes() / 1024:>11.1f}{build_ms:>10.0f}{qps:>10.0f}"
+                  f"{neighbour_recall:>11.3f}{item_top1:>8.2f}{item_top5:>8.2f}")
+    finally:
+        del exact_vectors
+        os.remove(exact_file.name)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare compressed knowledge base indexes with the float32 one.")
+    parser.add_argument("--embedder", choices=("ollama", "hashing"), default="ollama")
+    parser.add_argument("--embed-model", default=EMBED_MODEL, help="Ollama embedding model")
+    parser.add_argument("--queries", default=EVAL_QUERIES_PATH, help="labelled queries JSON file")
+    parser.add_argument("--k", type=int, default=10, help="neighbours compared with the float32 index")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="add this many noisy copies of the phrases to simulate a larger knowledge base")
+    parser.add_argument("--rerank", type=int, default=RERANK_CANDIDATES, help="candidates reranked exactly")
+    args = parser.parse_args()
+
+    with open(args.queries) as queries_file:
+        compare_indexes(make_embedder(args.embedder, args.embed_model), load_knowledge_base(),
+                        json.load(queries_file), args.k, args.synthetic, args.rerank)